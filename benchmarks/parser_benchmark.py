@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import importlib.util
+
+benchmark_folder = os.path.dirname(os.path.abspath(__file__))
+fixture_folder = os.path.join(benchmark_folder, "fixtures")
+source_file = os.path.join(benchmark_folder, "..", "src", "BookBounty.py")
+
+
+def load_bookbounty():
+    # BookBounty creates its config and download folders in the working directory on import.
+    os.chdir(tempfile.mkdtemp(prefix="bookbounty-benchmark-"))
+    spec = importlib.util.spec_from_file_location("BookBounty", source_file)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["BookBounty"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def time_parser(parse, html, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        parse(html)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the bs4 and fast parser backends on the saved Libgen pages.")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    fixtures = {}
+    for file_name in sorted(os.listdir(fixture_folder)):
+        with open(os.path.join(fixture_folder, file_name), encoding="utf-8") as f:
+            fixtures[file_name] = f.read()
+
+    data_handler = load_bookbounty().data_handler
+    backends = ["bs4", "fast"]
+    failures = 0
+
+    print(f"{'fixture':<36}{'size':>9}{'bs4 ms':>10}{'fast ms':>10}{'speedup':>9}")
+    for file_name, html in fixtures.items():
+        parse = data_handler.parse_fiction_results if file_name.startswith("fiction") else data_handler.parse_mirror_page
+        results = {}
+        timings = {}
+        for backend in backends:
+            data_handler.html_parser_backend = backend
+            results[backend] = parse(html)
+            timings[backend] = time_parser(parse, html, args.iterations)
+
+        if results["bs4"] != results["fast"]:
+            failures += 1
+            print(f"{file_name}: output differs\n  bs4:  {results['bs4']}\n  fast: {results['fast']}")
+            continue
+
+        speedup = timings["bs4"] / timings["fast"] if timings["fast"] else 0
+        print(f"{file_name:<36}{len(html):>9}{timings['bs4'] * 1000:>10.3f}{timings['fast'] * 1000:>10.3f}{speedup:>8.1f}x")
+
+    if failures:
+        print(f"{failures} fixture(s) parsed differently")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
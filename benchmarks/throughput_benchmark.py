@@ -0,0 +1,293 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import resource
+import threading
+import subprocess
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from parser_benchmark import load_bookbounty
+
+result_marker = "BENCHMARK_RESULT "
+
+
+def book_md5(index):
+    return hashlib.md5(f"benchmark-{index}".encode()).hexdigest().upper()
+
+
+def book_author(index):
+    return (f"Writer{index % 997}", "Alex")
+
+
+def book_title(index):
+    return f"Benchmark Book {index}"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # Stands in for Readarr, the Libgen fiction search, the mirror pages and the file host.
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status_code, body, content_type="text/html"):
+        self.send_response(status_code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def simulate(self, kind):
+        config = self.server.config
+        time.sleep(config["latency"].get(kind, 0))
+        if kind != "readarr" and random.random() < config["error_rate"]:
+            self.send(503, b"Service Unavailable")
+            return False
+        return True
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == "/api/v1/wanted/missing":
+            if self.simulate("readarr"):
+                self.send(200, json.dumps(self.wanted_page(int(query["page"][0]), int(query["pageSize"][0]))).encode(), "application/json")
+        elif url.path == "/api/v1/rootfolder":
+            if self.simulate("readarr"):
+                self.send(200, json.dumps([{"path": "/books"}]).encode(), "application/json")
+        elif url.path.startswith("/fiction/"):
+            if self.simulate("search"):
+                self.send(200, self.fiction_page(query.get("q", [""])[0]).encode())
+        elif url.path.startswith("/mirror/"):
+            if self.simulate("mirror"):
+                md5 = url.path.rsplit("/", 1)[-1]
+                self.send(200, f'<html><body><div id="download"><h2><a href="http://{self.headers["Host"]}/file/{md5}.epub">GET</a></h2></div></body></html>'.encode())
+        elif url.path.startswith("/file/"):
+            if self.simulate("file"):
+                self.send_file()
+        else:
+            self.send(404, b"Not Found")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith("/api/v1/command") and self.simulate("readarr"):
+            self.send(201, b"{}", "application/json")
+
+    def wanted_page(self, page, page_size):
+        total_records = self.server.config["items"]
+        records = []
+        for index in range((page - 1) * page_size, min(page * page_size, total_records)):
+            last_name, first_name = book_author(index)
+            title = book_title(index)
+            records.append({"id": index + 1, "title": title, "authorTitle": f"{last_name}, {first_name} {title}", "seriesTitle": "", "releaseDate": "2000-01-01T00:00:00Z"})
+        return {"page": page, "pageSize": page_size, "totalRecords": total_records, "records": records}
+
+    def fiction_page(self, query_text):
+        match = re.search(r"Benchmark Book (\d+)", query_text)
+        rows = []
+        if match:
+            index = int(match.group(1))
+            last_name, first_name = book_author(index)
+            for row in range(self.server.config["rows"]):
+                title = book_title(index) if row == 0 else f"{book_title(index)} Companion Volume {row}"
+                md5 = book_md5(index) if row == 0 else hashlib.md5(f"decoy-{index}-{row}".encode()).hexdigest().upper()
+                rows.append(
+                    f'<tr>\n<td><ul class="catalog_authors"><li><a href="/fiction/?q={last_name}">{last_name}, {first_name}</a></li></ul></td>\n<td></td>\n'
+                    f'<td><p><a href="/fiction/{md5}">{title}</a></p>\n<p class="catalog_identifier">ISBN: 9780000000000</p></td>\n<td>English</td>\n<td title="Uploaded at 2021-01-01">EPUB / 1 Mb</td>\n'
+                    f'<td><ul class="record_mirrors_compact"><li><a href="http://{self.headers["Host"]}/mirror/{md5}" title="Libgen.rs">[1]</a></li></ul></td>\n<td><a href="/fiction/{md5}">Edit</a></td>\n</tr>'
+                )
+        return '<html><head><title>Library Genesis: Fiction</title></head><body><table class="catalog"><thead><tr><td>Author(s)</td></tr></thead><tbody>\n' + "\n".join(rows) + "\n</tbody></table></body></html>"
+
+    def send_file(self):
+        file_size = self.server.config["file_size"]
+        block = self.server.file_block
+        self.send_response(200)
+        self.send_header("Content-Type", "application/epub+zip")
+        self.send_header("Content-Length", str(file_size))
+        self.end_headers()
+        sent = 0
+        while sent < file_size:
+            chunk = block[: file_size - sent]
+            self.wfile.write(chunk)
+            sent += len(chunk)
+
+
+def start_mock_server(config):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    server.daemon_threads = True
+    server.config = config
+    server.file_block = b"\0" * min(config["file_size"], 1048576) or b"\0"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0, "p90": 0, "p99": 0}
+    values = sorted(values)
+    return {name: values[min(len(values) - 1, int(len(values) * fraction))] * 1000 for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))}
+
+
+def timed(timings, func):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings.append(time.perf_counter() - start)
+
+    return wrapper
+
+
+def run_child(items, server_address, engine, extra_env):
+    if engine == "gevent":
+        from gevent import monkey
+
+        monkey.patch_all()
+
+    # The mock serves the same bytes for every book, so the files cannot match the MD5s in the links.
+    os.environ.update({"readarr_address": server_address, "readarr_api_key": "benchmark", "libgen_address": server_address, "sleep_interval": "0", "thread_limit": "8", "queue_engine": engine, "download_verify_md5": "false"})
+    os.environ.update(extra_env)
+    module = load_bookbounty()
+    work_folder = os.getcwd()
+    data_handler = module.data_handler
+
+    emitted_bytes = [0]
+    original_emit = module.socketio.emit
+
+    def counting_emit(event, *args, **kwargs):
+        emitted_bytes[0] += len(json.dumps([event, *args], default=str))
+        return original_emit(event, *args, **kwargs)
+
+    module.socketio.emit = counting_emit
+
+    stage_timings = {"search": [], "resolve": [], "download": []}
+    for stage, timings in stage_timings.items():
+        setattr(data_handler, f"{stage}_stage", timed(timings, getattr(data_handler, f"{stage}_stage")))
+
+    start = time.perf_counter()
+    data_handler.get_wanted_list_from_readarr()
+    readarr_seconds = time.perf_counter() - start
+
+    queue_start = time.perf_counter()
+    data_handler.add_items_to_download([item["readarr_id"] for item in data_handler.readarr_items])
+    while data_handler.work_queue.running:
+        time.sleep(0.05)
+    queue_seconds = time.perf_counter() - queue_start
+
+    statuses = {}
+    for req_item in data_handler.libgen_items:
+        statuses[req_item["status"]] = statuses.get(req_item["status"], 0) + 1
+    completed = statuses.get("Download Complete", 0)
+    total_seconds = readarr_seconds + queue_seconds
+
+    result = {
+        "items": items,
+        "engine": engine,
+        "completed": completed,
+        "statuses": statuses,
+        "readarr_seconds": readarr_seconds,
+        "queue_seconds": queue_seconds,
+        "books_per_minute": completed / total_seconds * 60 if total_seconds else 0,
+        "stages": {stage: percentiles(timings) for stage, timings in stage_timings.items()},
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "socketio_bytes": emitted_bytes[0],
+    }
+    shutil.rmtree(work_folder, ignore_errors=True)
+    print(result_marker + json.dumps(result), flush=True)
+    os._exit(0)
+
+
+def run_size(items, args, server):
+    server.config["items"] = items
+    command = [sys.executable, os.path.abspath(__file__), "--child", str(items), "--server", f"http://127.0.0.1:{server.server_port}", "--engine", args.engine]
+    for setting in args.env:
+        command += ["--env", setting]
+    completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL if not args.verbose else None, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith(result_marker):
+            return json.loads(line[len(result_marker) :])
+        if args.verbose:
+            print(line)
+    raise Exception(f"Benchmark run with {items} items failed (exit code {completed.returncode})")
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return ""
+
+
+def print_results(results, baseline):
+    baseline_runs = {run["items"]: run for run in baseline.get("runs", [])} if baseline else {}
+    print(f"{'items':>7}{'done':>7}{'books/min':>11}{'readarr s':>11}{'search p50/p90/p99 ms':>25}{'resolve p50/p90/p99 ms':>25}{'download p50/p90/p99 ms':>26}{'RSS MB':>8}{'socket.io KB':>14}")
+    for run in results["runs"]:
+        stages = ""
+        for stage, width in (("search", 25), ("resolve", 25), ("download", 26)):
+            latencies = "/".join(f"{run['stages'][stage][name]:.0f}" for name in ("p50", "p90", "p99"))
+            stages += f"{latencies:>{width}}"
+        line = f"{run['items']:>7}{run['completed']:>7}{run['books_per_minute']:>11.1f}{run['readarr_seconds']:>11.2f}{stages}{run['peak_rss_mb']:>8.0f}{run['socketio_bytes'] / 1024:>14.1f}"
+        if run["items"] in baseline_runs and baseline_runs[run["items"]]["books_per_minute"]:
+            line += f"  ({run['books_per_minute'] / baseline_runs[run['items']]['books_per_minute']:.2f}x vs {baseline.get('revision') or 'baseline'})"
+        print(line)
+        other_statuses = {status: count for status, count in run["statuses"].items() if status != "Download Complete"}
+        if other_statuses:
+            print(f"{'':>7}not completed: {other_statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end BookBounty throughput against local mock Readarr and Libgen servers.")
+    parser.add_argument("--items", type=int, nargs="+", default=[10, 1000, 10000], help="Wanted list sizes to run")
+    parser.add_argument("--engine", default="threads", choices=["threads", "pipeline", "gevent"])
+    parser.add_argument("--env", action="append", default=[], metavar="SETTING=VALUE", help="BookBounty setting for the run, e.g. thread_limit=16 (repeatable)")
+    parser.add_argument("--readarr-latency", type=float, default=0.01, help="Seconds per Readarr request")
+    parser.add_argument("--search-latency", type=float, default=0.05, help="Seconds per Libgen search page")
+    parser.add_argument("--mirror-latency", type=float, default=0.02, help="Seconds per mirror page")
+    parser.add_argument("--file-latency", type=float, default=0.02, help="Seconds before a file download starts")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of Libgen requests answered with 503")
+    parser.add_argument("--file-size", type=int, default=65536, help="Size of each downloaded book (bytes)")
+    parser.add_argument("--rows", type=int, default=25, help="Rows on each search result page")
+    parser.add_argument("--output", help="Write the results as JSON to compare against later runs")
+    parser.add_argument("--baseline", help="Results JSON from an earlier run to compare books/min against")
+    parser.add_argument("--verbose", action="store_true", help="Show the app log of each run")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--server", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(args.child, args.server, args.engine, dict(setting.split("=", 1) for setting in args.env))
+        return
+
+    config = {
+        "items": 0,
+        "latency": {"readarr": args.readarr_latency, "search": args.search_latency, "mirror": args.mirror_latency, "file": args.file_latency},
+        "error_rate": args.error_rate,
+        "file_size": args.file_size,
+        "rows": max(1, args.rows),
+    }
+    server = start_mock_server(config)
+    results = {"revision": git_revision(), "engine": args.engine, "env": args.env, "mock": config, "runs": []}
+    for items in args.items:
+        results["runs"].append(run_size(items, args, server))
+    server.shutdown()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,1433 @@
 import os
 import re
+import sys
+import bz2
+import gzip
 import time
 import json
-import shutil
+import hashlib
+import hmac
+import pstats
+import cProfile
+import contextlib
+import sqlite3
+import heapq
+import random
+import bisect
+import queue
 import logging
-import tempfile
+import platform
+import itertools
+import collections
+import functools
 import threading
+import weakref
 import concurrent.futures
 import requests
-from flask import Flask, render_template
+import gevent.pool
+from gevent import monkey
+from urllib.parse import urlparse, quote
+from html.parser import HTMLParser
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, Response, render_template, request, jsonify
 from flask_socketio import SocketIO
+from socketio import packet as socketio_packet
 from bs4 import BeautifulSoup
-from thefuzz import fuzz
-from libgen_api import LibgenSearch
+from rapidfuzz import fuzz, process
+
+
+@functools.lru_cache(maxsize=8192)
+def normalize_name(name):
+    name_string = name.replace(".", " ").replace(":", " ").replace(",", " ")
+    new_string = "".join(e for e in name_string if e.isalnum() or e.isspace()).lower()
+    words = new_string.split()
+    words.sort()
+    return " ".join(words)
+
+
+class SqliteStore:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # One connection per OS thread, greenlets on the same thread share it instead of each opening their own.
+        self.local = monkey.get_original("threading", "local")()
+        self.create_tables()
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def create_tables(self):
+        pass
+
+
+class ThreadpoolCalls:
+    # Runs every method of the wrapped object on gevent's threadpool, so greenlets keep running while it blocks.
+    def __init__(self, target):
+        self.target = target
+
+    def __getattr__(self, name):
+        attribute = getattr(self.target, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            return gevent.get_hub().threadpool.apply(attribute, args, kwargs)
+
+        return call
+
+
+class SearchCache(SqliteStore):
+    def __init__(self, db_path):
+        self.put_counter = 0
+        super().__init__(db_path)
+
+    def create_tables(self):
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS search_cache (query_key TEXT PRIMARY KEY, candidates TEXT, links TEXT, created REAL, expires REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS search_cache_created ON search_cache (created)")
+
+    def get(self, query_key):
+        row = self.connection().execute("SELECT candidates, links FROM search_cache WHERE query_key = ? AND expires > ?", (query_key, time.time())).fetchone()
+        if row:
+            return {"candidates": json.loads(row[0]), "links": json.loads(row[1])}
+        return None
+
+    def put(self, query_key, candidates, links, ttl, max_entries):
+        if ttl <= 0:
+            return
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?, ?, ?)", (query_key, json.dumps(candidates), json.dumps(links), now, now + ttl))
+        self.put_counter += 1
+        if self.put_counter % 100 == 0:
+            self.evict(max_entries)
+
+    def evict(self, max_entries):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM search_cache WHERE expires <= ?", (time.time(),))
+            conn.execute("DELETE FROM search_cache WHERE query_key IN (SELECT query_key FROM search_cache ORDER BY created DESC LIMIT -1 OFFSET ?)", (max_entries,))
+
+
+class WantedStore(SqliteStore):
+    def create_tables(self):
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS wanted_books (book_id INTEGER PRIMARY KEY, item TEXT, fingerprint TEXT, status TEXT, last_seen REAL)")
+
+    def fingerprint(self, item):
+        return json.dumps([item["author"], item["book_name"], item["series"], item["year"]])
+
+    def apply_sync(self, items, remove_missing):
+        now = time.time()
+        with self.connection() as conn:
+            stored = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT book_id, fingerprint, status FROM wanted_books")}
+            added_ids, changed_ids = set(), set()
+            for item in items:
+                book_id = item["readarr_id"]
+                fingerprint = self.fingerprint(item)
+                if book_id not in stored:
+                    added_ids.add(book_id)
+                    conn.execute("INSERT INTO wanted_books VALUES (?, ?, ?, '', ?)", (book_id, json.dumps(item), fingerprint, now))
+                elif stored[book_id][0] != fingerprint:
+                    changed_ids.add(book_id)
+                    conn.execute("UPDATE wanted_books SET item = ?, fingerprint = ?, status = '', last_seen = ? WHERE book_id = ?", (json.dumps(item), fingerprint, now, book_id))
+                else:
+                    item["status"] = stored[book_id][1]
+                    conn.execute("UPDATE wanted_books SET last_seen = ? WHERE book_id = ?", (now, book_id))
+
+            removed_ids = set()
+            if remove_missing:
+                removed_ids = set(stored) - {item["readarr_id"] for item in items}
+                conn.executemany("DELETE FROM wanted_books WHERE book_id = ?", [(book_id,) for book_id in removed_ids])
+
+        return added_ids, changed_ids, removed_ids
+
+    def items(self, book_ids=None):
+        query = "SELECT item, status FROM wanted_books"
+        params = []
+        if book_ids is not None:
+            book_ids = list(book_ids)
+            query += f" WHERE book_id IN ({', '.join('?' * len(book_ids))})"
+            params = book_ids
+        items = []
+        for item, status in self.connection().execute(query, params):
+            item = json.loads(item)
+            item["status"] = status
+            items.append(item)
+        return items
+
+    def unsettled_ids(self):
+        # Only a download or an existing file settles a book, failures are searched again on the next sync.
+        return {row[0] for row in self.connection().execute("SELECT book_id FROM wanted_books WHERE status NOT IN ('Download Complete', 'File Already Exists')")}
+
+    def update_status(self, book_id, status):
+        with self.connection() as conn:
+            conn.execute("UPDATE wanted_books SET status = ? WHERE book_id = ?", (status, book_id))
+
+
+class RetryStore(SqliteStore):
+    def create_tables(self):
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS retry_schedule (book_id INTEGER PRIMARY KEY, reason TEXT, attempts INTEGER, state TEXT, next_eligible REAL, updated REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS retry_schedule_due ON retry_schedule (state, next_eligible)")
+
+    def attempts(self, book_id):
+        row = self.connection().execute("SELECT attempts FROM retry_schedule WHERE book_id = ?", (book_id,)).fetchone()
+        return row[0] if row else 0
+
+    def record_failure(self, book_id, reason, attempts, next_eligible):
+        state = "waiting" if next_eligible is not None else "given_up"
+        with self.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO retry_schedule VALUES (?, ?, ?, ?, ?, ?)", (book_id, reason, attempts, state, next_eligible, time.time()))
+
+    def clear(self, book_id):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM retry_schedule WHERE book_id = ?", (book_id,))
+
+    def scheduled_ids(self):
+        return {row[0] for row in self.connection().execute("SELECT book_id FROM retry_schedule")}
+
+    def claim_due(self, now):
+        # Books Readarr no longer wants are dropped, the rest are marked as queued until they finish again.
+        with self.connection() as conn:
+            conn.execute("DELETE FROM retry_schedule WHERE book_id NOT IN (SELECT book_id FROM wanted_books)")
+            rows = conn.execute("SELECT r.book_id, w.item FROM retry_schedule r JOIN wanted_books w ON w.book_id = r.book_id WHERE r.state = 'waiting' AND r.next_eligible <= ? ORDER BY r.next_eligible", (now,)).fetchall()
+            conn.executemany("UPDATE retry_schedule SET state = 'queued', updated = ? WHERE book_id = ?", [(now, book_id) for book_id, _ in rows])
+        return [json.loads(item) for _, item in rows]
+
+    def release_queued(self, keep_ids=(), delay_for=None):
+        now = time.time()
+        keep_ids = set(keep_ids)
+        with self.connection() as conn:
+            queued_rows = conn.execute("SELECT book_id, reason, next_eligible FROM retry_schedule WHERE state = 'queued'").fetchall()
+            released = [(now + delay_for(reason) if delay_for else next_eligible, book_id) for book_id, reason, next_eligible in queued_rows if book_id not in keep_ids]
+            conn.executemany("UPDATE retry_schedule SET state = 'waiting', next_eligible = ? WHERE book_id = ?", released)
+
+    def summary(self):
+        summary = {}
+        for reason, state, count, next_eligible in self.connection().execute("SELECT reason, state, COUNT(*), MIN(next_eligible) FROM retry_schedule GROUP BY reason, state"):
+            summary.setdefault(reason, {})[state] = {"count": count, "next_eligible": next_eligible}
+        return summary
+
+
+class QueueStore(SqliteStore):
+    def create_tables(self):
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS download_queue (queue_id INTEGER PRIMARY KEY AUTOINCREMENT, book_id INTEGER, item TEXT, state TEXT, status TEXT, created REAL, updated REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS download_queue_state ON download_queue (state)")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(download_queue)")]
+            if "priority" not in columns:
+                conn.execute("ALTER TABLE download_queue ADD COLUMN priority INTEGER DEFAULT 0")
+            if "lease_owner" not in columns:
+                conn.execute("ALTER TABLE download_queue ADD COLUMN lease_owner TEXT")
+                conn.execute("ALTER TABLE download_queue ADD COLUMN lease_expires REAL")
+
+    def add(self, item, priority):
+        now = time.time()
+        with self.connection() as conn:
+            if item.get("readarr_id") is not None:
+                row = conn.execute("SELECT queue_id FROM download_queue WHERE book_id = ? AND state IN ('pending', 'in_progress')", (item["readarr_id"],)).fetchone()
+                if row:
+                    return row[0], False
+            cursor = conn.execute("INSERT INTO download_queue (book_id, item, state, status, created, updated, priority) VALUES (?, ?, 'pending', 'Queued', ?, ?, ?)", (item.get("readarr_id"), json.dumps(item), now, now, priority))
+            return cursor.lastrowid, True
+
+    def set_state(self, queue_id, state, status):
+        with self.connection() as conn:
+            conn.execute("UPDATE download_queue SET state = ?, status = ?, updated = ?, lease_owner = CASE WHEN ? = 'in_progress' THEN lease_owner END WHERE queue_id = ?", (state, status, time.time(), state, queue_id))
+
+    def requeue_in_flight(self):
+        # Items leased by another worker that is still renewing its lease are left alone.
+        now = time.time()
+        with self.connection() as conn:
+            return conn.execute("UPDATE download_queue SET state = 'pending', status = 'Queued', updated = ?, lease_owner = NULL WHERE state = 'in_progress' AND (lease_owner IS NULL OR lease_expires < ?)", (now, now)).rowcount
+
+    def claim(self, owner, lease_seconds):
+        now = time.time()
+        with self.connection() as conn:
+            row = conn.execute(
+                "UPDATE download_queue SET state = 'in_progress', lease_owner = ?, lease_expires = ?, updated = ? WHERE queue_id = "
+                "(SELECT queue_id FROM download_queue WHERE state = 'pending' OR (state = 'in_progress' AND lease_expires < ?) ORDER BY priority, queue_id LIMIT 1) "
+                "RETURNING queue_id, item, priority",
+                (owner, now + lease_seconds, now, now),
+            ).fetchone()
+        if row is None:
+            return None
+        item = json.loads(row[1])
+        item.update({"id": row[0], "queue_id": row[0], "status": "Queued", "priority": row[2]})
+        return item
+
+    def renew_leases(self, owner, lease_seconds):
+        with self.connection() as conn:
+            conn.execute("UPDATE download_queue SET lease_expires = ? WHERE lease_owner = ? AND state = 'in_progress'", (time.time() + lease_seconds, owner))
+
+    def finished_statuses(self):
+        return {queue_id: status for queue_id, status in self.connection().execute("SELECT queue_id, status FROM download_queue WHERE state IN ('done', 'stopped')")}
+
+    def claimable_count(self):
+        return self.connection().execute("SELECT COUNT(*) FROM download_queue WHERE state = 'pending' OR (state = 'in_progress' AND lease_expires < ?)", (time.time(),)).fetchone()[0]
+
+    def pending_items(self):
+        items = []
+        for queue_id, item, priority in self.connection().execute("SELECT queue_id, item, priority FROM download_queue WHERE state = 'pending' ORDER BY priority, queue_id"):
+            item = json.loads(item)
+            item.update({"id": queue_id, "queue_id": queue_id, "status": "Queued", "priority": priority})
+            items.append(item)
+        return items
+
+    def stop_active(self):
+        with self.connection() as conn:
+            conn.execute("UPDATE download_queue SET state = 'stopped', status = 'Download Stopped', updated = ?, lease_owner = NULL WHERE state IN ('pending', 'in_progress')", (time.time(),))
+
+    def clear_finished(self):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM download_queue WHERE state IN ('done', 'stopped')")
+
+    def clear(self):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM download_queue")
+
+    def summary(self):
+        return {state: count for state, count in self.connection().execute("SELECT state, COUNT(*) FROM download_queue GROUP BY state")}
+
+    def view(self):
+        rows = []
+        for queue_id, item, status in self.connection().execute("SELECT queue_id, item, status FROM download_queue ORDER BY queue_id"):
+            item = json.loads(item)
+            rows.append({"id": queue_id, "author": item["author"], "book_name": item["book_name"], "status": status})
+        return rows
+
+    def page(self, state, offset, limit):
+        query = "SELECT queue_id, book_id, item, state, status, created, updated FROM download_queue"
+        params = []
+        if state:
+            query += " WHERE state = ?"
+            params.append(state)
+        query += " ORDER BY queue_id LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        columns = ["queue_id", "book_id", "item", "state", "status", "created", "updated"]
+        rows = []
+        for row in self.connection().execute(query, params):
+            row = dict(zip(columns, row))
+            row["item"] = json.loads(row["item"])
+            rows.append(row)
+        return rows
+
+
+class CoordinationStore(SqliteStore):
+    def create_tables(self):
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS leader_leases (name TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS shared_counters (name TEXT PRIMARY KEY, value INTEGER)")
+
+    def acquire(self, name, owner, ttl):
+        now = time.time()
+        with self.connection() as conn:
+            conn.execute("INSERT OR IGNORE INTO leader_leases VALUES (?, '', 0)", (name,))
+            return conn.execute("UPDATE leader_leases SET owner = ?, expires = ? WHERE name = ? AND (owner = ? OR expires < ?)", (owner, now + ttl, name, owner, now)).rowcount == 1
+
+    def counter(self, name):
+        row = self.connection().execute("SELECT value FROM shared_counters WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def increment(self, name):
+        with self.connection() as conn:
+            return conn.execute("INSERT INTO shared_counters VALUES (?, 1) ON CONFLICT (name) DO UPDATE SET value = value + 1 RETURNING value", (name,)).fetchone()[0]
+
+
+class LocalIndex(SqliteStore):
+    # Libgen dump tables and the search type they belong to.
+    dump_tables = {"fiction": "fiction", "updated": "non-fiction"}
+    create_table_pattern = re.compile(r"CREATE TABLE `?(\w+)`?", re.IGNORECASE)
+    column_pattern = re.compile(r"\s*`(\w+)`")
+    insert_pattern = re.compile(r"INSERT INTO `?(\w+)`?\s*(?:\(([^)]*)\))?\s*VALUES\s*", re.IGNORECASE)
+    value_pattern = re.compile(r"'((?:[^'\\]|\\.|'')*)'|(\()|(\))|([^,()\s']+)", re.DOTALL)
+    escape_pattern = re.compile(r"\\(.)", re.DOTALL)
+    escapes = {"0": "\0", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a", "b": "\b"}
+    batch_size = 5000
+
+    def create_tables(self):
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS local_books (id INTEGER PRIMARY KEY, md5 TEXT UNIQUE, source TEXT, author TEXT, title TEXT, language TEXT, extension TEXT, filesize INTEGER, last_modified TEXT)")
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS local_books_fts USING fts5(author, title, content='local_books', content_rowid='id', tokenize='unicode61 remove_diacritics 2')")
+            conn.execute("CREATE TRIGGER IF NOT EXISTS local_books_insert AFTER INSERT ON local_books BEGIN INSERT INTO local_books_fts (rowid, author, title) VALUES (new.id, new.author, new.title); END")
+            conn.execute("CREATE TRIGGER IF NOT EXISTS local_books_delete AFTER DELETE ON local_books BEGIN INSERT INTO local_books_fts (local_books_fts, rowid, author, title) VALUES ('delete', old.id, old.author, old.title); END")
+            conn.execute("CREATE TRIGGER IF NOT EXISTS local_books_update AFTER UPDATE ON local_books BEGIN INSERT INTO local_books_fts (local_books_fts, rowid, author, title) VALUES ('delete', old.id, old.author, old.title); INSERT INTO local_books_fts (rowid, author, title) VALUES (new.id, new.author, new.title); END")
+            conn.execute("CREATE TABLE IF NOT EXISTS local_index_state (source TEXT PRIMARY KEY, last_modified TEXT, updated REAL)")
+
+    def open_dump(self, dump_path):
+        if dump_path.endswith(".gz"):
+            return gzip.open(dump_path, "rt", encoding="utf-8", errors="replace")
+        if dump_path.endswith(".bz2"):
+            return bz2.open(dump_path, "rt", encoding="utf-8", errors="replace")
+        return open(dump_path, "r", encoding="utf-8", errors="replace")
+
+    def unescape(self, value):
+        if "\\" in value:
+            value = self.escape_pattern.sub(lambda match: self.escapes.get(match.group(1), match.group(1)), value)
+        return value.replace("''", "'")
+
+    def parse_values(self, values_text):
+        row = None
+        for match in self.value_pattern.finditer(values_text):
+            quoted, row_start, row_end, bare = match.groups()
+            if row_start:
+                row = []
+            elif row_end:
+                if row is not None:
+                    yield row
+                row = None
+            elif row is not None:
+                if quoted is not None:
+                    row.append(self.unescape(quoted))
+                else:
+                    row.append(None if bare.upper() == "NULL" else bare)
+
+    def import_dump(self, dump_path, full_refresh, logger):
+        table_columns = {}
+        current_table = None
+        watermarks = {}
+        counts = {}
+        batch = []
+
+        with self.connection() as conn:
+            for source, last_modified in conn.execute("SELECT source, last_modified FROM local_index_state"):
+                watermarks[source] = "" if full_refresh else last_modified
+        newest = dict(watermarks)
+
+        with self.open_dump(dump_path) as dump_file:
+            for line in dump_file:
+                create_table = self.create_table_pattern.match(line)
+                if create_table:
+                    current_table = create_table.group(1).lower()
+                    table_columns[current_table] = []
+                    continue
+                if current_table:
+                    column = self.column_pattern.match(line)
+                    if column:
+                        table_columns[current_table].append(column.group(1).lower())
+                        continue
+                    if line.startswith(")"):
+                        current_table = None
+
+                insert = self.insert_pattern.match(line)
+                if not insert or insert.group(1).lower() not in self.dump_tables:
+                    continue
+                table = insert.group(1).lower()
+                source = self.dump_tables[table]
+                columns = [column.strip(" `").lower() for column in insert.group(2).split(",")] if insert.group(2) else table_columns.get(table)
+                if not columns:
+                    raise Exception(f"No column list found for table {table}")
+
+                watermark = watermarks.get(source) or ""
+                imported, skipped = counts.get(source, (0, 0))
+                for values in self.parse_values(line[insert.end() :]):
+                    record = dict(zip(columns, values))
+                    last_modified = record.get("timelastmodified") or ""
+                    if watermark and last_modified and last_modified <= watermark:
+                        skipped += 1
+                        continue
+                    newest[source] = max(newest.get(source) or "", last_modified)
+                    batch.append((source, record))
+                    imported += 1
+                    if len(batch) >= self.batch_size:
+                        self.write_batch(batch)
+                        batch = []
+                counts[source] = (imported, skipped)
+                logger.warning(f"Local index import: {source} {imported} imported, {skipped} unchanged")
+
+        self.write_batch(batch)
+        with self.connection() as conn:
+            for source in counts:
+                conn.execute("INSERT OR REPLACE INTO local_index_state VALUES (?, ?, ?)", (source, newest.get(source) or "", time.time()))
+        return counts
+
+    def write_batch(self, batch):
+        upserts, deletions = [], []
+        for source, record in batch:
+            md5 = (record.get("md5") or "").lower()
+            if not md5:
+                continue
+            if record.get("visible"):
+                # Libgen hides removed or banned records by filling in the Visible column.
+                deletions.append((md5,))
+                continue
+            try:
+                filesize = int(record.get("filesize") or 0)
+            except ValueError:
+                filesize = 0
+            upserts.append((md5, source, record.get("author") or "", record.get("title") or "", record.get("language") or "", (record.get("extension") or "").lower(), filesize, record.get("timelastmodified") or ""))
+
+        with self.connection() as conn:
+            conn.executemany(
+                "INSERT INTO local_books (md5, source, author, title, language, extension, filesize, last_modified) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(md5) DO UPDATE SET source = excluded.source, author = excluded.author, title = excluded.title, language = excluded.language, "
+                "extension = excluded.extension, filesize = excluded.filesize, last_modified = excluded.last_modified",
+                upserts,
+            )
+            conn.executemany("DELETE FROM local_books WHERE md5 = ?", deletions)
+
+    def match_expression(self, column, text, minimum_length=1):
+        words = [word for word in re.findall(r"\w+", text.lower()) if len(word) >= minimum_length]
+        if not words:
+            return None
+        return f"{column} : (" + " AND ".join(f'"{word}"' for word in words) + ")"
+
+    def search(self, source, author, title, language, limit=200):
+        # Initials are often written differently, so only full author names have to match.
+        expressions = [expression for expression in (self.match_expression("title", title), self.match_expression("author", author, 2)) if expression]
+        if not expressions:
+            return []
+        query = "SELECT b.md5, b.author, b.title, b.language, b.extension, b.filesize FROM local_books_fts JOIN local_books b ON b.id = local_books_fts.rowid WHERE local_books_fts MATCH ? AND b.source = ?"
+        params = [" AND ".join(expressions), source]
+        if language:
+            query += " AND b.language = ? COLLATE NOCASE"
+            params.append(language)
+        query += " ORDER BY bm25(local_books_fts) LIMIT ?"
+        params.append(limit)
+        columns = ["md5", "author", "title", "language", "extension", "filesize"]
+        return [dict(zip(columns, row)) for row in self.connection().execute(query, params)]
+
+    def summary(self):
+        counts = {row[0]: row[1] for row in self.connection().execute("SELECT source, COUNT(*) FROM local_books GROUP BY source")}
+        return {row[0]: {"books": counts.get(row[0], 0), "last_modified": row[1], "updated": row[2]} for row in self.connection().execute("SELECT source, last_modified, updated FROM local_index_state")}
+
+
+class MirrorHealth(SqliteStore):
+    columns = ("successes", "failures", "consecutive_failures", "success_rate", "ttfb", "throughput", "open_until")
+    smoothing = 0.3
+    reference_size = 5242880
+
+    def __init__(self, db_path):
+        self.hosts = {}
+        self.lock = threading.Lock()
+        super().__init__(db_path)
+        for row in self.connection().execute(f"SELECT host, {', '.join(self.columns)} FROM mirror_health"):
+            self.hosts[row[0]] = dict(zip(self.columns, row[1:]))
+
+    def create_tables(self):
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS mirror_health (host TEXT PRIMARY KEY, successes INTEGER, failures INTEGER, consecutive_failures INTEGER, success_rate REAL, ttfb REAL, throughput REAL, open_until REAL, updated REAL)")
+
+    def host_state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = {"successes": 0, "failures": 0, "consecutive_failures": 0, "success_rate": 1.0, "ttfb": None, "throughput": None, "open_until": 0}
+        return state
+
+    def smooth(self, previous, value):
+        if previous is None:
+            return value
+        return previous + self.smoothing * (value - previous)
+
+    def save(self, host, state):
+        with self.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO mirror_health VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (host, *(state[column] for column in self.columns), time.time()))
+
+    def record_success(self, host, ttfb=None, throughput=None):
+        with self.lock:
+            state = self.host_state(host)
+            state["successes"] += 1
+            state["consecutive_failures"] = 0
+            state["open_until"] = 0
+            state["success_rate"] = self.smooth(state["success_rate"], 1.0)
+            if ttfb is not None:
+                state["ttfb"] = self.smooth(state["ttfb"], ttfb)
+            if throughput:
+                state["throughput"] = self.smooth(state["throughput"], throughput)
+            state = dict(state)
+        self.save(host, state)
+
+    def record_failure(self, host, threshold, cooldown):
+        with self.lock:
+            state = self.host_state(host)
+            state["failures"] += 1
+            state["consecutive_failures"] += 1
+            state["success_rate"] = self.smooth(state["success_rate"], 0.0)
+            tripped = threshold > 0 and state["consecutive_failures"] >= threshold
+            if tripped:
+                state["open_until"] = time.time() + cooldown
+            state = dict(state)
+        self.save(host, state)
+        return tripped
+
+    def allow(self, host, cooldown):
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is None or not state["open_until"]:
+                return True
+            now = time.time()
+            if state["open_until"] > now:
+                return False
+            # The cool-down is over: let this request through and keep the host closed to others until it reports back.
+            state["open_until"] = now + cooldown
+            return True
+
+    def expected_seconds(self, host):
+        # Estimated time to fetch a typical book, divided by the chance that the attempt works.
+        state = self.hosts.get(host) or {}
+        ttfb = state.get("ttfb") or 1.0
+        throughput = state.get("throughput") or 1048576
+        return (ttfb + self.reference_size / throughput) / max(state.get("success_rate", 1.0), 0.05)
+
+    def order_links(self, links, by_score):
+        now = time.time()
+        with self.lock:
+            available = [link for link in links if self.hosts.get(urlparse(link).netloc, {}).get("open_until", 0) <= now]
+            if by_score:
+                available.sort(key=lambda link: self.expected_seconds(urlparse(link).netloc))
+        return available
+
+    def summary(self):
+        now = time.time()
+        with self.lock:
+            return [
+                {"host": host, **state, "expected_seconds": self.expected_seconds(host), "circuit": "open" if state["open_until"] > now else "closed"}
+                for host, state in sorted(self.hosts.items())
+            ]
+
+
+class ContentHashStore(SqliteStore):
+    def create_tables(self):
+        with self.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS content_hashes (md5 TEXT PRIMARY KEY, path TEXT, size INTEGER, created REAL)")
+
+    def get(self, md5):
+        row = self.connection().execute("SELECT path FROM content_hashes WHERE md5 = ?", (md5,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, md5, path, size):
+        with self.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO content_hashes VALUES (?, ?, ?, ?)", (md5, path, size, time.time()))
+
+    def remove(self, md5):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM content_hashes WHERE md5 = ?", (md5,))
+
+
+class LibraryIndex:
+    # Every path type ends a file name with "<author> - <title> (<year>)", in the download folder itself or below
+    # author and series folders with a series prefix. Books are matched on the trailing author and title words of
+    # the file names, so they are found whichever path type or release year they were saved with.
+    year_suffix = re.compile(r"\s*\(\d*\)$")
+
+    def __init__(self, root):
+        self.root = root
+        self.books = set()
+        self.keys = set()
+        self.folders = {}
+        self.readarr_ids = set()
+        self.lock = threading.Lock()
+
+    def words(self, text):
+        return tuple(re.sub(r"\W+", " ", text).lower().split())
+
+    def book_words(self, file_path):
+        return self.words(self.year_suffix.sub("", os.path.splitext(os.path.basename(file_path))[0]))
+
+    def key(self, author, book_name):
+        return self.words(f"{author} {book_name}")
+
+    def scan(self, extensions):
+        # Folders whose modification time has not changed keep their cached file list.
+        folders = {}
+        books = set()
+        rescanned = self.scan_folder(self.root, extensions, folders, books)
+        keys = {words[i:] for words in books for i in range(len(words))}
+        with self.lock:
+            self.folders = folders
+            self.books = books
+            self.keys = keys
+        return rescanned
+
+    def scan_folder(self, folder, extensions, folders, books):
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            return 0
+
+        rescanned = 0
+        cached = self.folders.get(folder)
+        if cached and cached[0] == mtime:
+            folder_books, subfolders = cached[1], cached[2]
+        else:
+            rescanned = 1
+            folder_books, subfolders = set(), []
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subfolders.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in extensions:
+                        folder_books.add(self.book_words(entry.path))
+
+        folders[folder] = (mtime, folder_books, subfolders)
+        books.update(folder_books)
+        for subfolder in subfolders:
+            rescanned += self.scan_folder(subfolder, extensions, folders, books)
+        return rescanned
+
+    def add(self, file_path):
+        words = self.book_words(file_path)
+        with self.lock:
+            self.books.add(words)
+            self.keys.update(words[i:] for i in range(len(words)))
+
+    def add_readarr_ids(self, readarr_ids):
+        with self.lock:
+            self.readarr_ids.update(readarr_ids)
+
+    def contains(self, author, book_name, readarr_id=None):
+        with self.lock:
+            return self.key(author, book_name) in self.keys or (readarr_id is not None and readarr_id in self.readarr_ids)
+
+
+class HostThrottle:
+    def __init__(self, host, rate, max_concurrency, logger):
+        self.host = host
+        self.rate = rate
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency_limit = float(self.max_concurrency)
+        self.active = 0
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.condition = threading.Condition()
+        self.logger = logger
+
+    def acquire(self, stop_event=None):
+        with self.condition:
+            while self.active >= int(self.concurrency_limit):
+                # Waiting for a slot is polled so a stop can interrupt it.
+                if stop_event is not None and stop_event.is_set():
+                    raise Exception("Cancelled")
+                self.condition.wait(timeout=None if stop_event is None else 1)
+            self.active += 1
+
+            wait_time = 0
+            if self.rate > 0:
+                now = time.monotonic()
+                self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait_time = -self.tokens / self.rate
+
+        if wait_time > 0:
+            if stop_event is None:
+                time.sleep(wait_time)
+            elif stop_event.wait(wait_time):
+                self.cancel()
+                raise Exception("Cancelled")
+
+    def cancel(self):
+        # Gives back a slot that was never used, without touching the concurrency limit.
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def release(self, throttled):
+        with self.condition:
+            self.active -= 1
+            previous_limit = int(self.concurrency_limit)
+            if throttled:
+                self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+            else:
+                self.concurrency_limit = min(float(self.max_concurrency), self.concurrency_limit + 1 / self.concurrency_limit)
+            if int(self.concurrency_limit) != previous_limit:
+                self.logger.warning(f"Concurrency limit for {self.host} now {int(self.concurrency_limit)}")
+            self.condition.notify_all()
+
+
+class HttpClient:
+    def __init__(self, pool_size, connect_timeout, read_timeout, retries, retry_backoff, host_timeouts, host_rates, default_host_rate, host_concurrency, default_host_concurrency, logger):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.host_timeouts = host_timeouts
+        self.host_rates = host_rates
+        self.default_host_rate = default_host_rate
+        self.host_concurrency = host_concurrency
+        self.default_host_concurrency = default_host_concurrency
+        self.logger = logger
+        self.sessions = {}
+        self.throttles = {}
+        self.sessions_lock = threading.Lock()
+
+    def session(self, host):
+        with self.sessions_lock:
+            session = self.sessions.get(host)
+            if session is None:
+                retry = Retry(
+                    total=self.retries,
+                    backoff_factor=self.retry_backoff,
+                    # 429 and 503 are left to the host throttle, retrying them here would hit a throttling mirror again before it backs off.
+                    status_forcelist=[500, 502, 504],
+                    allowed_methods=["GET", "HEAD", "OPTIONS"],
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self.sessions[host] = session
+            return session
+
+    def throttle(self, host):
+        with self.sessions_lock:
+            throttle = self.throttles.get(host)
+            if throttle is None:
+                hostname = host.split(":")[0]
+                rate = self.host_rates.get(host, self.host_rates.get(hostname, self.default_host_rate))
+                max_concurrency = self.host_concurrency.get(host, self.host_concurrency.get(hostname, self.default_host_concurrency))
+                throttle = HostThrottle(host, rate, max_concurrency, self.logger)
+                self.throttles[host] = throttle
+            return throttle
+
+    def timeout(self, host):
+        connect_timeout, read_timeout = self.host_timeouts.get(host, (self.connect_timeout, self.read_timeout))
+        return (connect_timeout, read_timeout)
+
+    def request(self, method, url, stop_event=None, **kwargs):
+        host = urlparse(url).netloc
+        kwargs.setdefault("timeout", self.timeout(host))
+        throttle = self.throttle(host)
+        throttle.acquire(stop_event)
+        throttled = True
+        held = False
+        try:
+            response = self.session(host).request(method, url, **kwargs)
+            throttled = response.status_code in (429, 503)
+            if kwargs.get("stream"):
+                self.hold_until_consumed(response, throttle, throttled)
+                held = True
+            return response
+
+        except requests.exceptions.ConnectionError as e:
+            throttled = True
+            raise e
+
+        except requests.exceptions.Timeout as e:
+            throttled = True
+            raise e
+
+        except Exception as e:
+            throttled = False
+            raise e
+
+        finally:
+            if not held:
+                throttle.release(throttled)
+
+    def hold_until_consumed(self, response, throttle, throttled):
+        # Streamed bodies keep their host slot until they are read to the end, closed or garbage collected.
+        # The wrappers only hold weak references to the response, so it is collected as soon as it is dropped.
+        release_lock = threading.Lock()
+        released = [False]
+
+        def release(body_throttled=throttled):
+            with release_lock:
+                if released[0]:
+                    return
+                released[0] = True
+            throttle.release(body_throttled)
+
+        original_close = weakref.WeakMethod(response.close)
+        original_iter_content = weakref.WeakMethod(response.iter_content)
+
+        def close():
+            try:
+                original_close()()
+            finally:
+                release()
+
+        def iter_content(*args, **kwargs):
+            try:
+                yield from original_iter_content()(*args, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                release(True)
+                raise
+            finally:
+                release()
+
+        response.close = close
+        response.iter_content = iter_content
+        weakref.finalize(response, release)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def close(self):
+        with self.sessions_lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
+
+class WorkQueue:
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.active_keys = set()
+        self.in_flight = 0
+        self.running = False
+
+    def key(self, req_item):
+        return ("readarr", req_item["readarr_id"]) if req_item.get("readarr_id") is not None else ("queue", req_item["queue_id"])
+
+    def put(self, req_item, priority):
+        with self.condition:
+            key = self.key(req_item)
+            if key in self.active_keys:
+                return False
+            self.active_keys.add(key)
+            heapq.heappush(self.heap, (priority, next(self.counter), req_item))
+            self.condition.notify()
+            return True
+
+    def get(self, stop_event):
+        with self.condition:
+            while True:
+                if stop_event.is_set():
+                    return None
+                if self.heap:
+                    self.in_flight += 1
+                    return heapq.heappop(self.heap)[2]
+                if self.in_flight == 0:
+                    self.condition.notify_all()
+                    return None
+                self.condition.wait(timeout=1)
+
+    def task_done(self, req_item):
+        with self.condition:
+            self.in_flight -= 1
+            self.active_keys.discard(self.key(req_item))
+            self.condition.notify_all()
+
+    def claim_run(self):
+        with self.condition:
+            if self.running:
+                return False
+            self.running = True
+            return True
+
+    def finish_run(self):
+        with self.condition:
+            if self.heap:
+                return False
+            self.running = False
+            return True
+
+    def clear(self):
+        with self.condition:
+            cleared_items = [entry[2] for entry in self.heap]
+            for req_item in cleared_items:
+                self.active_keys.discard(self.key(req_item))
+            self.heap = []
+            self.condition.notify_all()
+            return cleared_items
+
+    def qsize(self):
+        with self.condition:
+            return len(self.heap)
+
+
+class SharedWorkQueue(WorkQueue):
+    # Work is claimed from the download_queue table with a lease, so several processes can split one queue.
+    def __init__(self, queue_store, owner, lease_seconds):
+        super().__init__()
+        self.queue_store = queue_store
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.local_items = {}
+
+    def put(self, req_item, priority):
+        # The item is already in the shared table; keep this process's copy so status changes reach the web UI.
+        with self.condition:
+            self.local_items[req_item["queue_id"]] = req_item
+            self.condition.notify()
+        return True
+
+    def get(self, stop_event):
+        while True:
+            if stop_event.is_set():
+                return None
+            req_item = self.queue_store.claim(self.owner, self.lease_seconds)
+            with self.condition:
+                if req_item is not None:
+                    self.in_flight += 1
+                    return self.local_items.get(req_item["queue_id"], req_item)
+                if self.in_flight == 0:
+                    self.condition.notify_all()
+                    return None
+                self.condition.wait(timeout=1)
+
+    def task_done(self, req_item):
+        with self.condition:
+            self.in_flight -= 1
+            self.local_items.pop(req_item["queue_id"], None)
+            self.condition.notify_all()
+
+    def clear(self):
+        with self.condition:
+            self.local_items = {}
+            self.condition.notify_all()
+        return []
+
+    def qsize(self):
+        return self.queue_store.claimable_count()
+
+
+class QueueServerClient:
+    # Stands in for the QueueStore of a SharedWorkQueue on hosts that cannot open the web process's SQLite files.
+    max_backoff = 30
+    finish_attempts = 5
+
+    def __init__(self, address, token, timeout, logger):
+        self.address = address.rstrip("/")
+        self.timeout = timeout
+        self.logger = logger
+        self.session = requests.Session()
+        self.session.headers["X-Api-Key"] = token
+        self.claimable = 0
+        self.failures = 0
+        self.failures_lock = threading.Lock()
+
+    def post(self, action, payload):
+        try:
+            response = self.session.post(f"{self.address}/api/workers/{action}", json=payload, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            # Every caller waits out the same growing delay, so an unreachable queue server is not hammered.
+            with self.failures_lock:
+                self.failures += 1
+                delay = min(self.max_backoff, 2**self.failures)
+            self.logger.warning(f"Queue Server {action} failed, retrying in {delay}s: {str(e)}")
+            time.sleep(delay)
+            raise
+        with self.failures_lock:
+            self.failures = 0
+        return response.json()
+
+    def claim(self, owner, lease_seconds):
+        # A failed claim counts as nothing claimable, the monitor starts the queue again once the server answers.
+        try:
+            return self.post("claim", {"worker_id": owner, "lease_seconds": lease_seconds})["item"]
+        except requests.RequestException:
+            self.claimable = 0
+            return None
+
+    def claimable_count(self):
+        return self.claimable
+
+    def heartbeat(self, owner, lease_seconds, changes):
+        reply = self.post("heartbeat", {"worker_id": owner, "lease_seconds": lease_seconds, "changes": changes})
+        self.claimable = reply["claimable"]
+        return reply["stop_generation"], reply["start_generation"]
+
+    def finish(self, req_item, state):
+        payload = {"queue_id": req_item["queue_id"], "readarr_id": req_item.get("readarr_id"), "state": state, "status": req_item["status"]}
+        for attempt in range(self.finish_attempts):
+            try:
+                self.post("finish", payload)
+                return
+            except requests.RequestException:
+                if attempt == self.finish_attempts - 1:
+                    raise
+
+
+class PipelineStage:
+    END = object()
+
+    def __init__(self, name, workers, func, input_queue, output_queue, data_handler):
+        self.name = name
+        self.workers = max(1, workers)
+        self.func = func
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.data_handler = data_handler
+        self.threads = []
+        self.processed = 0
+        self.active_workers = self.workers
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.started = time.monotonic()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.run, name=f"Pipeline_{self.name.capitalize()}_{i}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def run(self):
+        while True:
+            if isinstance(self.input_queue, WorkQueue):
+                req_item = self.input_queue.get(self.data_handler.libgen_stop_event)
+                if req_item is None:
+                    break
+                work = (req_item, None)
+            else:
+                work = self.input_queue.get()
+                if work is PipelineStage.END:
+                    self.input_queue.put(PipelineStage.END)
+                    break
+
+            req_item, payload = work
+            result = None
+            try:
+                if not self.data_handler.libgen_stop_event.is_set():
+                    result = self.data_handler.run_profiled(self.func, req_item, payload)
+
+            except Exception as e:
+                self.data_handler.general_logger.error(f"Error in {self.name} stage: {str(e)}")
+                self.data_handler.update_libgen_item(req_item, status="Download Error")
+                result = None
+
+            with self.lock:
+                self.processed += 1
+
+            if result and self.output_queue is not None:
+                self.output_queue.put((req_item, result))
+            else:
+                self.data_handler.finish_item(req_item)
+
+        with self.lock:
+            self.active_workers -= 1
+            last_worker = self.active_workers == 0
+        if last_worker and self.output_queue is not None:
+            self.output_queue.put(PipelineStage.END)
+
+    def stats(self):
+        elapsed_minutes = max(time.monotonic() - self.started, 1) / 60
+        return {"stage": self.name, "workers": self.workers, "queue_depth": self.input_queue.qsize(), "processed": self.processed, "per_minute": self.processed / elapsed_minutes}
+
+
+class Metrics:
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.descriptions = {}
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def describe(self, name, metric_type, help_text, buckets=None):
+        self.descriptions[name] = (metric_type, help_text, tuple(buckets or self.default_buckets))
+
+    def gauge(self, name, help_text, callback):
+        # Gauges are read from the callback when scraped, so nothing is recorded while working.
+        self.describe(name, "gauge", help_text)
+        self.gauges[name] = callback
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = self.descriptions.get(name, ("histogram", "", self.default_buckets))[2]
+        key = (name, tuple(sorted(labels.items())))
+        bucket_index = bisect.bisect_left(buckets, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            histogram[bucket_index] += 1
+            histogram[-1] += value
+
+    def format_labels(self, labels):
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{name}="{self.escape_label(value)}"' for name, value in labels) + "}"
+
+    def escape_label(self, value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def render(self):
+        samples = {}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                samples.setdefault(name, []).append((labels, value))
+            for (name, labels), histogram in self.histograms.items():
+                samples.setdefault(name, []).append((labels, list(histogram)))
+        for name, callback in self.gauges.items():
+            try:
+                samples[name] = [(tuple(sorted(labels.items())), value) for labels, value in callback()]
+            except Exception:
+                samples[name] = []
+
+        lines = []
+        for name in sorted(samples):
+            metric_type, help_text, buckets = self.descriptions.get(name, ("counter", "", self.default_buckets))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in sorted(samples[name], key=lambda sample: sample[0]):
+                if metric_type != "histogram":
+                    lines.append(f"{name}{self.format_labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ["+Inf"], value[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self.format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{self.format_labels(labels)} {value[-1]}")
+                lines.append(f"{name}_count{self.format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+class MeteredPacket(socketio_packet.Packet):
+    # Counted where Socket.IO encodes the packet anyway, once per emit rather than once per client.
+    def encode(self):
+        encoded_packet = super().encode()
+        if self.packet_type == socketio_packet.EVENT and self.data:
+            metrics.inc("bookbounty_socketio_emit_bytes_total", len(encoded_packet), event=self.data[0])
+        return encoded_packet
+
+
+class MeteredSocketIO(SocketIO):
+    def __init__(self, app=None, **kwargs):
+        kwargs.setdefault("serializer", MeteredPacket)
+        super().__init__(app, **kwargs)
+
+    def emit(self, event, *args, **kwargs):
+        metrics.inc("bookbounty_socketio_emits_total", event=event)
+        return super().emit(event, *args, **kwargs)
+
+
+class TargetedHTMLParser(HTMLParser):
+    void_elements = {"area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta", "param", "source", "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex", "nextid", "spacer"}
+    raw_text_elements = {"script", "style"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []
+        self.done = False
+
+    def parse(self, html, chunk_size=16384):
+        for start in range(0, len(html), chunk_size):
+            self.feed(html[start : start + chunk_size])
+            if self.done:
+                return
+        self.close()
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        attrs = {name: "" if value is None else value for name, value in attrs}
+        element = self.open_element(tag, attrs)
+        if tag not in self.void_elements:
+            self.stack.append((tag, element))
+
+    def handle_endtag(self, tag):
+        if self.done or tag in self.void_elements:
+            return
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index][0] == tag:
+                for _, element in reversed(self.stack[index:]):
+                    if element:
+                        self.close_element(*element)
+                del self.stack[index:]
+                break
+
+    def handle_data(self, data):
+        if not self.done and not (self.stack and self.stack[-1][0] in self.raw_text_elements):
+            self.text(data)
+
+    def open_element(self, tag, attrs):
+        return None
+
+    def close_element(self, kind, value):
+        pass
+
+    def text(self, data):
+        pass
+
+
+class FictionResultsParser(TargetedHTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self.open_rows = []
+        self.open_cells = []
+
+    def parse(self, html):
+        table_start = re.search(r"<tbody[\s/>]", html, re.IGNORECASE)
+        if table_start:
+            super().parse(html[table_start.start() :])
+        return [(["".join(cell) for cell in row["cells"]], row["mirrors"] or []) for row in self.rows]
+
+    def open_element(self, tag, attrs):
+        if not self.stack:
+            return ("tbody", None)
+        if tag == "tr":
+            row = {"cells": [], "mirrors": None, "collecting": False}
+            self.rows.append(row)
+            self.open_rows.append(row)
+            return ("tr", row)
+        if tag == "td":
+            cell = []
+            for row in self.open_rows:
+                row["cells"].append(cell)
+            self.open_cells.append(cell)
+            return ("td", cell)
+        if tag == "ul" and "record_mirrors_compact" in attrs.get("class", "").split():
+            mirror_rows = [row for row in self.open_rows if row["mirrors"] is None]
+            for row in mirror_rows:
+                row["mirrors"] = []
+                row["collecting"] = True
+            return ("ul", mirror_rows)
+        if tag == "a" and "href" in attrs:
+            for row in self.open_rows:
+                if row["collecting"]:
+                    row["mirrors"].append(attrs["href"])
+        return None
+
+    def close_element(self, kind, value):
+        if kind == "tbody":
+            self.done = True
+        elif kind == "tr":
+            self.open_rows.pop()
+        elif kind == "td":
+            self.open_cells.pop()
+        elif kind == "ul":
+            for row in value:
+                row["collecting"] = False
+
+    def text(self, data):
+        for cell in self.open_cells:
+            cell.append(data)
+
+
+class MirrorPageParser(TargetedHTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.download_div = "missing"
+        self.download_link = None
+        self.table = "missing"
+        self.table_rows = []
+        self.open_table_rows = []
+
+    def parse(self, html):
+        super().parse(html)
+        if self.download_div != "missing":
+            return ("link", self.download_link[0]) if self.download_link else ("dead", None)
+        if self.table == "missing":
+            return ("none", None)
+        for row in self.table_rows:
+            if "GET" in "".join(row["text"]) and row["link"]:
+                return ("table_link", row["link"][0])
+        return ("dead", None)
+
+    def open_element(self, tag, attrs):
+        if tag == "div" and self.download_div == "missing" and attrs.get("id") == "download":
+            self.download_div = "open"
+            return ("download", None)
+        if tag == "table" and self.table == "missing":
+            self.table = "open"
+            return ("table", None)
+        if tag == "tr" and self.table == "open":
+            row = {"text": [], "link": None}
+            self.table_rows.append(row)
+            self.open_table_rows.append(row)
+            return ("tr", row)
+        if tag == "a":
+            if self.download_div == "open" and not self.download_link:
+                self.download_link = (attrs.get("href"),)
+                self.done = True
+            for row in self.open_table_rows:
+                if not row["link"]:
+                    row["link"] = (attrs.get("href"),)
+        return None
+
+    def close_element(self, kind, value):
+        if kind == "download":
+            self.download_div = "closed"
+            self.done = True
+        elif kind == "table":
+            self.table = "closed"
+        elif kind == "tr":
+            self.open_table_rows.pop()
+
+    def text(self, data):
+        for row in self.open_table_rows:
+            row["text"].append(data)
+
+
+class NonFictionSearch:
+    column_names = ["ID", "Author", "Title", "Publisher", "Year", "Pages", "Language", "Size", "Extension", "Mirror_1", "Mirror_2", "Mirror_3", "Mirror_4", "Mirror_5", "Edit"]
+    mirror_sources = ["GET", "Cloudflare", "IPFS.io", "Infura"]
+
+    def __init__(self, http_client, libgen_address, stop_event, link_cache_size=4096):
+        self.http_client = http_client
+        self.libgen_address = libgen_address
+        self.stop_event = stop_event
+        self.link_cache = collections.OrderedDict()
+        self.link_cache_size = link_cache_size
+        self.link_cache_lock = threading.Lock()
+
+    def search_title_filtered(self, query, filters):
+        if len(query) < 3:
+            raise Exception("Query is too short")
+
+        response = self.http_client.get(f"{self.libgen_address}/search.php?req={quote(query)}&column=title", stop_event=self.stop_event)
+        if response.status_code != 200:
+            raise Exception(f"Libgen Connection Error: {response.status_code}")
+
+        parse_start = time.perf_counter()
+        soup = BeautifulSoup(response.text, "html.parser")
+        for subheading in soup.find_all("i"):
+            subheading.decompose()
+
+        # The results are in the third table, the first row of which holds the headings.
+        tables = soup.find_all("table")
+        if len(tables) < 3:
+            return []
+        results = [dict(zip(self.column_names, [self.cell_value(cell) for cell in row.find_all("td")])) for row in tables[2].find_all("tr")[1:]]
+        metrics.observe("bookbounty_parse_seconds", time.perf_counter() - parse_start, page="non_fiction_results", backend="bs4")
+        return [result for result in results if all(value.casefold() in result.get(field, "").casefold() for field, value in filters.items())]
+
+    def cell_value(self, cell):
+        # Mirror links carry a title attribute, title links have an empty one.
+        link = cell.find("a")
+        if link and link.get("title"):
+            return link.get("href", "")
+        return "".join(cell.stripped_strings)
+
+    def resolve_download_links(self, item):
+        mirror_url = item["Mirror_1"]
+        md5 = re.search(r"[0-9a-fA-F]{32}", mirror_url)
+        cache_key = md5.group(0).lower() if md5 else mirror_url
+        with self.link_cache_lock:
+            if cache_key in self.link_cache:
+                self.link_cache.move_to_end(cache_key)
+                return list(self.link_cache[cache_key])
+
+        resolve_start = time.monotonic()
+        response = self.http_client.get(mirror_url, stop_event=self.stop_event)
+        soup = BeautifulSoup(response.text, "html.parser")
+        download_links = {link.string: link["href"] for link in soup.find_all("a", string=self.mirror_sources) if link.get("href")}
+        links = list(download_links.values())
+        metrics.observe("bookbounty_mirror_resolve_seconds", time.monotonic() - resolve_start, host=urlparse(mirror_url).netloc)
+
+        if links:
+            with self.link_cache_lock:
+                self.link_cache[cache_key] = links
+                while len(self.link_cache) > self.link_cache_size:
+                    self.link_cache.popitem(last=False)
+        return list(links)
 
 
 class DataHandler:
@@ -32,14 +1447,25 @@ class DataHandler:
         self.readarr_stop_event = threading.Event()
 
         self.libgen_items = []
-        self.libgen_futures = []
         self.libgen_status = "idle"
         self.libgen_stop_event = threading.Event()
-        self.libgen_thread_lock = threading.Lock()
+        self.libgen_user_stopped = False
 
-        self.libgen_in_progress_flag = False
-        self.index = 0
+        self.work_queue = WorkQueue()
+        self.libgen_completed_ids = set()
+        self.libgen_positions = {}
         self.percent_completion = 0
+        self.manual_priority = 0
+        self.resume_priority = 5
+        self.scheduled_priority = 10
+        self.retry_priority = 20
+        self.retry_check_interval = 60
+
+        self.libgen_update_seq = 0
+        self.libgen_pending_changes = {}
+        self.libgen_pending_reset = False
+        self.libgen_last_summary = None
+        self.libgen_update_lock = threading.RLock()
 
         self.clients_connected_counter = 0
         self.config_folder = "config"
@@ -49,7 +1475,67 @@ class DataHandler:
             os.makedirs(self.config_folder)
         if not os.path.exists(self.download_folder):
             os.makedirs(self.download_folder)
+        self.database_file = os.path.join(self.config_folder, "bookbounty.db")
+        self.search_cache = SearchCache(self.database_file)
+        self.wanted_store = WantedStore(self.database_file)
+        self.queue_store = QueueStore(self.database_file)
+        self.retry_store = RetryStore(self.database_file)
+        self.coordination = CoordinationStore(self.database_file)
+        self.worker_id = f"{platform.node()}-{os.getpid()}"
+        self.stop_generation = self.coordination.counter("stop_generation")
+        self.start_generation = self.coordination.counter("start_generation")
+        self.local_index = LocalIndex(os.path.join(self.config_folder, "libgen_index.db"))
+        self.mirror_health = MirrorHealth(self.database_file)
+        self.library_index = LibraryIndex(self.download_folder)
+        self.content_hashes = ContentHashStore(self.database_file)
+        self.md5_pattern = re.compile(r"(?<![0-9a-fA-F])[0-9a-fA-F]{32}(?![0-9a-fA-F])")
+        self.readarr_changed_ids = set()
+        self.download_progress_log_bytes = 10485760
+        self.download_sidecar_save_bytes = 8388608
+        self.pipeline_stages = []
+        self.pipeline_report_interval = 30
+        self.item_traces = collections.OrderedDict()
+        self.item_traces_lock = threading.Lock()
+        self.item_trace_limit = 20000
+        self.item_link_md5s = collections.OrderedDict()
+        self.item_link_md5s_lock = threading.Lock()
+        self.md5_reservations = {}
+        self.md5_reservation_events = {}
+        self.md5_reservations_lock = threading.Lock()
+        self.profilers = []
+        self.profile_lock = threading.Lock()
+        self.profile_until = 0
+        self.profile_file = None
+        self.gevent_profiler = None
+        self.gevent_profiled_items = 0
+        self.queue_server = None
+        self.register_metrics()
         self.load_environ_or_config_settings()
+        if self.queue_server is None:
+            self.resume_download_queue()
+
+    def register_metrics(self):
+        fast_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+        throughput_buckets = (16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+        metrics.describe("bookbounty_readarr_page_seconds", "histogram", "Time to fetch one page of the Readarr wanted list.")
+        metrics.describe("bookbounty_search_seconds", "histogram", "Time to search for one book, including parsing and matching.")
+        metrics.describe("bookbounty_search_cache_total", "counter", "Search cache lookups by result.")
+        metrics.describe("bookbounty_parse_seconds", "histogram", "Time to parse a Libgen page.", fast_buckets)
+        metrics.describe("bookbounty_match_outcomes_total", "counter", "Searches by outcome (matched, no_match or error).")
+        metrics.describe("bookbounty_mirror_resolve_seconds", "histogram", "Time to resolve a mirror page to a download link.")
+        metrics.describe("bookbounty_download_bytes_total", "counter", "Bytes downloaded by mirror host.")
+        metrics.describe("bookbounty_download_seconds", "histogram", "Time spent downloading one file by mirror host.")
+        metrics.describe("bookbounty_download_throughput_bytes_per_second", "histogram", "Download speed of one file by mirror host.", throughput_buckets)
+        metrics.describe("bookbounty_items_finished_total", "counter", "Queue items finished by outcome.")
+        metrics.describe("bookbounty_socketio_emits_total", "counter", "Socket.IO events emitted.")
+        metrics.describe("bookbounty_socketio_emit_bytes_total", "counter", "Approximate JSON size of emitted Socket.IO events.")
+        metrics.gauge("bookbounty_queue_items", "Download queue items by state.", lambda: [({"state": state}, count) for state, count in self.queue_store.summary().items()])
+        metrics.gauge("bookbounty_work_queue_waiting", "Items waiting for a worker.", lambda: [({}, self.work_queue.qsize())])
+        metrics.gauge("bookbounty_active_workers", "Items being worked on right now.", lambda: [({}, self.work_queue.in_flight)])
+        metrics.gauge("bookbounty_pipeline_queue_depth", "Items waiting at each pipeline stage.", lambda: [({"stage": stats["stage"]}, stats["queue_depth"]) for stats in self.pipeline_stats()])
+        metrics.gauge("bookbounty_download_progress_percent", "Share of the current session that has finished.", lambda: [({}, self.percent_completion)])
+        metrics.gauge("bookbounty_mirror_success_rate", "Smoothed success rate of each mirror host.", lambda: [({"host": state["host"]}, state["success_rate"]) for state in self.mirror_health.summary()])
+        metrics.gauge("bookbounty_mirror_circuit_open", "Mirror hosts currently skipped after repeated failures.", lambda: [({"host": state["host"]}, int(state["circuit"] == "open")) for state in self.mirror_health.summary()])
 
     def load_environ_or_config_settings(self):
         # Defaults
@@ -70,6 +1556,60 @@ class DataHandler:
             "preferred_extensions_non_fiction": [".pdf", ".epub", ".mobi", ".azw3", ".djvu"],
             "search_last_name_only": False,
             "search_shortened_title": False,
+            "update_emit_interval": 0.5,
+            "search_cache_hit_ttl_hours": 168,
+            "search_cache_miss_ttl_hours": 12,
+            "search_cache_max_entries": 50000,
+            "connect_timeout": 10.0,
+            "http_pool_size": 0,
+            "http_retries": 3,
+            "http_retry_backoff": 0.5,
+            "host_timeouts": {},
+            "readarr_page_size": 1000,
+            "readarr_fetch_workers": 4,
+            "download_resume_attempts": 2,
+            "download_chunk_size": 1048576,
+            "download_buffer_size": 4194304,
+            "download_preallocate": False,
+            "mirror_racing": False,
+            "mirror_racing_max_probes": 8,
+            "default_host_rate": 0,
+            "host_rate_limits": {},
+            "default_host_concurrency": 8,
+            "host_max_concurrency": {},
+            "queue_engine": "threads",
+            "search_workers": 0,
+            "resolve_workers": 0,
+            "download_workers": 0,
+            "pipeline_run_ahead": 10,
+            "gevent_concurrency": 16,
+            "html_parser_backend": "bs4",
+            "search_source": "online",
+            "local_index_fiction_mirrors": ["http://library.lol/fiction/{md5}", "https://libgen.li/ads.php?md5={md5}"],
+            "local_index_non_fiction_mirrors": ["http://library.lol/main/{md5}"],
+            "mirror_health_ordering": True,
+            "mirror_failure_threshold": 3,
+            "mirror_cooldown_minutes": 30,
+            "library_index_enabled": True,
+            "library_index_rescan_minutes": 10,
+            "library_index_readarr_seed": False,
+            "download_verify_md5": True,
+            "duplicate_handling": "hardlink",
+            "retry_enabled": True,
+            "retry_policies": {
+                "No Link Found": [1440, 6],
+                "Libgen Error": [15, 10],
+                "Link Failed": [30, 8],
+                "Dead Link": [360, 5],
+                "Mirrors Unavailable": [30, 8],
+                "default": [60, 5],
+            },
+            "retry_max_delay_hours": 168,
+            "retry_jitter": 0.2,
+            "shared_queue": False,
+            "worker_lease_seconds": 60,
+            "queue_server_address": "",
+            "queue_server_token": "",
         }
 
         # Load settings from environmental variables (which take precedence) over the configuration file.
@@ -99,6 +1639,94 @@ class DataHandler:
         self.preferred_extensions_fiction = preferred_extensions_fiction.split(",") if preferred_extensions_fiction else ""
         preferred_extensions_non_fiction = os.environ.get("preferred_extensions_non_fiction", "")
         self.preferred_extensions_non_fiction = preferred_extensions_non_fiction.split(",") if preferred_extensions_non_fiction else ""
+        update_emit_interval = os.environ.get("update_emit_interval", "")
+        self.update_emit_interval = float(update_emit_interval) if update_emit_interval else ""
+        search_cache_hit_ttl_hours = os.environ.get("search_cache_hit_ttl_hours", "")
+        self.search_cache_hit_ttl_hours = float(search_cache_hit_ttl_hours) if search_cache_hit_ttl_hours else ""
+        search_cache_miss_ttl_hours = os.environ.get("search_cache_miss_ttl_hours", "")
+        self.search_cache_miss_ttl_hours = float(search_cache_miss_ttl_hours) if search_cache_miss_ttl_hours else ""
+        search_cache_max_entries = os.environ.get("search_cache_max_entries", "")
+        self.search_cache_max_entries = int(search_cache_max_entries) if search_cache_max_entries else ""
+        connect_timeout = os.environ.get("connect_timeout", "")
+        self.connect_timeout = float(connect_timeout) if connect_timeout else ""
+        http_pool_size = os.environ.get("http_pool_size", "")
+        self.http_pool_size = int(http_pool_size) if http_pool_size else ""
+        http_retries = os.environ.get("http_retries", "")
+        self.http_retries = int(http_retries) if http_retries else ""
+        http_retry_backoff = os.environ.get("http_retry_backoff", "")
+        self.http_retry_backoff = float(http_retry_backoff) if http_retry_backoff else ""
+        host_timeouts = os.environ.get("host_timeouts", "")
+        self.host_timeouts = json.loads(host_timeouts) if host_timeouts else ""
+        readarr_page_size = os.environ.get("readarr_page_size", "")
+        self.readarr_page_size = int(readarr_page_size) if readarr_page_size else ""
+        readarr_fetch_workers = os.environ.get("readarr_fetch_workers", "")
+        self.readarr_fetch_workers = int(readarr_fetch_workers) if readarr_fetch_workers else ""
+        download_resume_attempts = os.environ.get("download_resume_attempts", "")
+        self.download_resume_attempts = int(download_resume_attempts) if download_resume_attempts else ""
+        download_chunk_size = os.environ.get("download_chunk_size", "")
+        self.download_chunk_size = int(download_chunk_size) if download_chunk_size else ""
+        download_buffer_size = os.environ.get("download_buffer_size", "")
+        self.download_buffer_size = int(download_buffer_size) if download_buffer_size else ""
+        download_preallocate = os.environ.get("download_preallocate", "")
+        self.download_preallocate = download_preallocate.lower() == "true" if download_preallocate != "" else ""
+        mirror_racing = os.environ.get("mirror_racing", "")
+        self.mirror_racing = mirror_racing.lower() == "true" if mirror_racing != "" else ""
+        mirror_racing_max_probes = os.environ.get("mirror_racing_max_probes", "")
+        self.mirror_racing_max_probes = int(mirror_racing_max_probes) if mirror_racing_max_probes else ""
+        default_host_rate = os.environ.get("default_host_rate", "")
+        self.default_host_rate = float(default_host_rate) if default_host_rate else ""
+        host_rate_limits = os.environ.get("host_rate_limits", "")
+        self.host_rate_limits = json.loads(host_rate_limits) if host_rate_limits else ""
+        default_host_concurrency = os.environ.get("default_host_concurrency", "")
+        self.default_host_concurrency = int(default_host_concurrency) if default_host_concurrency else ""
+        host_max_concurrency = os.environ.get("host_max_concurrency", "")
+        self.host_max_concurrency = json.loads(host_max_concurrency) if host_max_concurrency else ""
+        self.queue_engine = os.environ.get("queue_engine", "")
+        search_workers = os.environ.get("search_workers", "")
+        self.search_workers = int(search_workers) if search_workers else ""
+        resolve_workers = os.environ.get("resolve_workers", "")
+        self.resolve_workers = int(resolve_workers) if resolve_workers else ""
+        download_workers = os.environ.get("download_workers", "")
+        self.download_workers = int(download_workers) if download_workers else ""
+        pipeline_run_ahead = os.environ.get("pipeline_run_ahead", "")
+        self.pipeline_run_ahead = int(pipeline_run_ahead) if pipeline_run_ahead else ""
+        gevent_concurrency = os.environ.get("gevent_concurrency", "")
+        self.gevent_concurrency = int(gevent_concurrency) if gevent_concurrency else ""
+        self.html_parser_backend = os.environ.get("html_parser_backend", "")
+        self.search_source = os.environ.get("search_source", "")
+        local_index_fiction_mirrors = os.environ.get("local_index_fiction_mirrors", "")
+        self.local_index_fiction_mirrors = local_index_fiction_mirrors.split(",") if local_index_fiction_mirrors else ""
+        local_index_non_fiction_mirrors = os.environ.get("local_index_non_fiction_mirrors", "")
+        self.local_index_non_fiction_mirrors = local_index_non_fiction_mirrors.split(",") if local_index_non_fiction_mirrors else ""
+        mirror_health_ordering = os.environ.get("mirror_health_ordering", "")
+        self.mirror_health_ordering = mirror_health_ordering.lower() == "true" if mirror_health_ordering != "" else ""
+        mirror_failure_threshold = os.environ.get("mirror_failure_threshold", "")
+        self.mirror_failure_threshold = int(mirror_failure_threshold) if mirror_failure_threshold else ""
+        mirror_cooldown_minutes = os.environ.get("mirror_cooldown_minutes", "")
+        self.mirror_cooldown_minutes = float(mirror_cooldown_minutes) if mirror_cooldown_minutes else ""
+        library_index_enabled = os.environ.get("library_index_enabled", "")
+        self.library_index_enabled = library_index_enabled.lower() == "true" if library_index_enabled != "" else ""
+        library_index_rescan_minutes = os.environ.get("library_index_rescan_minutes", "")
+        self.library_index_rescan_minutes = float(library_index_rescan_minutes) if library_index_rescan_minutes else ""
+        library_index_readarr_seed = os.environ.get("library_index_readarr_seed", "")
+        self.library_index_readarr_seed = library_index_readarr_seed.lower() == "true" if library_index_readarr_seed != "" else ""
+        download_verify_md5 = os.environ.get("download_verify_md5", "")
+        self.download_verify_md5 = download_verify_md5.lower() == "true" if download_verify_md5 != "" else ""
+        self.duplicate_handling = os.environ.get("duplicate_handling", "")
+        retry_enabled = os.environ.get("retry_enabled", "")
+        self.retry_enabled = retry_enabled.lower() == "true" if retry_enabled != "" else ""
+        retry_policies = os.environ.get("retry_policies", "")
+        self.retry_policies = json.loads(retry_policies) if retry_policies else ""
+        retry_max_delay_hours = os.environ.get("retry_max_delay_hours", "")
+        self.retry_max_delay_hours = float(retry_max_delay_hours) if retry_max_delay_hours else ""
+        retry_jitter = os.environ.get("retry_jitter", "")
+        self.retry_jitter = float(retry_jitter) if retry_jitter else ""
+        shared_queue = os.environ.get("shared_queue", "")
+        self.shared_queue = shared_queue.lower() == "true" if shared_queue != "" else ""
+        worker_lease_seconds = os.environ.get("worker_lease_seconds", "")
+        self.worker_lease_seconds = float(worker_lease_seconds) if worker_lease_seconds else ""
+        self.queue_server_address = os.environ.get("queue_server_address", "")
+        self.queue_server_token = os.environ.get("queue_server_token", "")
 
         # Load variables from the configuration file if not set by environmental variables.
         try:
@@ -122,11 +1750,69 @@ class DataHandler:
         # Save config.
         self.save_config_to_file()
 
+        # Under the gevent engine SQLite work leaves the hub, a slow query or write would otherwise stall every greenlet
+        if self.gevent_enabled():
+            for store_name in ("search_cache", "wanted_store", "queue_store", "retry_store", "coordination", "local_index", "mirror_health", "content_hashes"):
+                setattr(self, store_name, ThreadpoolCalls(getattr(self, store_name)))
+
+        # Create HTTP Client
+        self.http_client = HttpClient(
+            pool_size=max(self.http_pool_size, self.readarr_fetch_workers, self.engine_concurrency()),
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.request_timeout,
+            retries=self.http_retries,
+            retry_backoff=self.http_retry_backoff,
+            host_timeouts=self.host_timeouts,
+            host_rates=self.host_rate_limits,
+            default_host_rate=self.default_host_rate,
+            host_concurrency=self.host_max_concurrency,
+            default_host_concurrency=self.default_host_concurrency,
+            logger=self.general_logger,
+        )
+        self.non_fiction_search = NonFictionSearch(self.http_client, self.libgen_address, self.libgen_stop_event)
+
+        # Build Library Index
+        if self.library_index_enabled:
+            self.refresh_library_index()
+            if self.library_index_rescan_minutes > 0:
+                thread = threading.Thread(target=self.library_index_rescanner, name="Library_Index_Thread")
+                thread.daemon = True
+                thread.start()
+
+        # Work for a queue server on another host, which runs the Readarr sync and the retries itself
+        if self.queue_server_address:
+            self.queue_server = QueueServerClient(self.queue_server_address, self.queue_server_token, self.request_timeout, self.general_logger)
+            self.work_queue = SharedWorkQueue(self.queue_server, self.worker_id, self.worker_lease_seconds)
+            self.stop_generation = None
+            self.start_generation = None
+            thread = threading.Thread(target=self.queue_server_monitor, name="Queue_Server_Thread")
+            thread.daemon = True
+            thread.start()
+            return
+
         # Start Scheduler
         thread = threading.Thread(target=self.schedule_checker, name="Schedule_Thread")
         thread.daemon = True
         thread.start()
 
+        # Share Download Queue
+        if self.shared_queue:
+            self.work_queue = SharedWorkQueue(self.queue_store, self.worker_id, self.worker_lease_seconds)
+            thread = threading.Thread(target=self.shared_queue_monitor, name="Shared_Queue_Thread")
+            thread.daemon = True
+            thread.start()
+
+        # Start Retry Scheduler
+        if self.retry_enabled:
+            thread = threading.Thread(target=self.retry_scheduler, name="Retry_Thread")
+            thread.daemon = True
+            thread.start()
+
+        # Start Update Emitter
+        thread = threading.Thread(target=self.libgen_update_emitter, name="Update_Emitter_Thread")
+        thread.daemon = True
+        thread.start()
+
     def save_config_to_file(self):
         try:
             with open(self.settings_config_file, "w") as json_file:
@@ -148,6 +1834,53 @@ class DataHandler:
                         "preferred_extensions_non_fiction": self.preferred_extensions_non_fiction,
                         "search_last_name_only": self.search_last_name_only,
                         "search_shortened_title": self.search_shortened_title,
+                        "update_emit_interval": self.update_emit_interval,
+                        "search_cache_hit_ttl_hours": self.search_cache_hit_ttl_hours,
+                        "search_cache_miss_ttl_hours": self.search_cache_miss_ttl_hours,
+                        "search_cache_max_entries": self.search_cache_max_entries,
+                        "connect_timeout": self.connect_timeout,
+                        "http_pool_size": self.http_pool_size,
+                        "http_retries": self.http_retries,
+                        "http_retry_backoff": self.http_retry_backoff,
+                        "host_timeouts": self.host_timeouts,
+                        "readarr_page_size": self.readarr_page_size,
+                        "readarr_fetch_workers": self.readarr_fetch_workers,
+                        "download_resume_attempts": self.download_resume_attempts,
+                        "download_chunk_size": self.download_chunk_size,
+                        "download_buffer_size": self.download_buffer_size,
+                        "download_preallocate": self.download_preallocate,
+                        "mirror_racing": self.mirror_racing,
+                        "mirror_racing_max_probes": self.mirror_racing_max_probes,
+                        "default_host_rate": self.default_host_rate,
+                        "host_rate_limits": self.host_rate_limits,
+                        "default_host_concurrency": self.default_host_concurrency,
+                        "host_max_concurrency": self.host_max_concurrency,
+                        "queue_engine": self.queue_engine,
+                        "search_workers": self.search_workers,
+                        "resolve_workers": self.resolve_workers,
+                        "download_workers": self.download_workers,
+                        "pipeline_run_ahead": self.pipeline_run_ahead,
+                        "gevent_concurrency": self.gevent_concurrency,
+                        "html_parser_backend": self.html_parser_backend,
+                        "search_source": self.search_source,
+                        "local_index_fiction_mirrors": self.local_index_fiction_mirrors,
+                        "local_index_non_fiction_mirrors": self.local_index_non_fiction_mirrors,
+                        "mirror_health_ordering": self.mirror_health_ordering,
+                        "mirror_failure_threshold": self.mirror_failure_threshold,
+                        "mirror_cooldown_minutes": self.mirror_cooldown_minutes,
+                        "library_index_enabled": self.library_index_enabled,
+                        "library_index_rescan_minutes": self.library_index_rescan_minutes,
+                        "library_index_readarr_seed": self.library_index_readarr_seed,
+                        "download_verify_md5": self.download_verify_md5,
+                        "duplicate_handling": self.duplicate_handling,
+                        "retry_enabled": self.retry_enabled,
+                        "retry_policies": self.retry_policies,
+                        "retry_max_delay_hours": self.retry_max_delay_hours,
+                        "retry_jitter": self.retry_jitter,
+                        "shared_queue": self.shared_queue,
+                        "worker_lease_seconds": self.worker_lease_seconds,
+                        "queue_server_address": self.queue_server_address,
+                        "queue_server_token": self.queue_server_token,
                     },
                     json_file,
                     indent=4,
@@ -156,26 +1889,277 @@ class DataHandler:
         except Exception as e:
             self.general_logger.error(f"Error Saving Config: {str(e)}")
 
-    def connect(self):
-        socketio.emit("readarr_update", {"status": self.readarr_status, "data": self.readarr_items})
-        socketio.emit("libgen_update", {"status": self.libgen_status, "data": self.libgen_items, "percent_completion": self.percent_completion})
+    def connect(self, sid):
+        self.emit_readarr_snapshot(to=sid)
+        self.emit_libgen_snapshot(to=sid)
         self.clients_connected_counter += 1
 
     def disconnect(self):
         self.clients_connected_counter = max(0, self.clients_connected_counter - 1)
 
+    def update_libgen_item(self, req_item, **changes):
+        with self.libgen_update_lock:
+            req_item.update(changes)
+            if "id" in req_item:
+                self.libgen_pending_changes.setdefault(req_item["id"], {}).update(changes)
+
+    def add_libgen_item(self, req_item):
+        # New rows go out in the next patch with the fields the queue table shows, a book queued again takes over its old row.
+        with self.libgen_update_lock:
+            row = {"author": req_item["author"], "book_name": req_item["book_name"], "status": req_item["status"]}
+            readarr_id = req_item.get("readarr_id")
+            position = self.libgen_positions.get(readarr_id) if readarr_id is not None else None
+            if position is None:
+                if readarr_id is not None:
+                    self.libgen_positions[readarr_id] = len(self.libgen_items)
+                self.libgen_items.append(req_item)
+            else:
+                previous_item = self.libgen_items[position]
+                self.libgen_items[position] = req_item
+                self.libgen_completed_ids.discard(previous_item["id"])
+                self.refresh_percent_completion()
+                if previous_item["id"] != req_item["id"]:
+                    row["previous_id"] = previous_item["id"]
+            self.libgen_pending_changes.setdefault(req_item["id"], {}).update(row)
+
+    def clear_libgen_items(self):
+        with self.libgen_update_lock:
+            self.libgen_items = []
+            self.libgen_positions = {}
+            self.libgen_completed_ids = set()
+            self.percent_completion = 0
+            self.libgen_pending_changes = {}
+            self.libgen_pending_reset = True
+
+    def emit_readarr_snapshot(self, to=None):
+        # The wanted list is the same for every browser, so without a client to answer the snapshot goes to all of them.
+        if self.shared_queue and self.readarr_status != "busy":
+            # Any worker may have run the last sync, so the wanted list comes from the shared store.
+            wanted_items = sorted(self.wanted_store.items(), key=lambda x: (x["author"], x["book_name"]))
+            unchecked_ids = {item["readarr_id"] for item in self.readarr_items if not item["checked"]}
+            for item in wanted_items:
+                item["checked"] = item["readarr_id"] not in unchecked_ids
+        else:
+            wanted_items = self.readarr_items
+        socketio.emit("readarr_update", {"status": self.readarr_status, "data": wanted_items}, to=to)
+
+    def emit_libgen_snapshot(self, to):
+        if to is None:
+            return
+        with self.libgen_update_lock:
+            if self.shared_queue:
+                # Every worker's items are in the shared queue, this worker's own ones carry their latest status.
+                local_statuses = {req_item["id"]: req_item["status"] for req_item in self.libgen_items}
+                queue_items = self.queue_store.view()
+                for row in queue_items:
+                    row["status"] = local_statuses.get(row["id"], row["status"])
+            else:
+                queue_items = self.libgen_items
+            payload = {"source": self.worker_id, "seq": self.libgen_update_seq, "status": self.libgen_status, "data": queue_items, "percent_completion": self.percent_completion}
+            socketio.emit("libgen_update", payload, to=to)
+
+    def flush_libgen_updates(self):
+        if self.queue_server:
+            return
+        with self.libgen_update_lock:
+            summary = (self.libgen_status, self.percent_completion)
+            if not self.libgen_pending_changes and not self.libgen_pending_reset and summary == self.libgen_last_summary:
+                return
+            changes = [{"id": item_id, **fields} for item_id, fields in self.libgen_pending_changes.items()]
+            self.libgen_pending_changes = {}
+            self.libgen_last_summary = summary
+            self.libgen_update_seq += 1
+            payload = {"source": self.worker_id, "seq": self.libgen_update_seq, "status": self.libgen_status, "percent_completion": self.percent_completion, "changes": changes}
+            if self.libgen_pending_reset:
+                payload["reset"] = True
+                self.libgen_pending_reset = False
+            socketio.emit("libgen_patch", payload)
+
+    def libgen_update_emitter(self):
+        while True:
+            time.sleep(self.update_emit_interval)
+            try:
+                self.flush_libgen_updates()
+
+            except Exception as e:
+                self.general_logger.error(f"Error Emitting Updates: {str(e)}")
+
+    def refresh_library_index(self):
+        try:
+            scan_start = time.monotonic()
+            extensions = {extension.lower() for extension in self.preferred_extensions_fiction + self.preferred_extensions_non_fiction}
+            rescanned_folders = self.library_index.scan(extensions)
+            self.general_logger.info(f"Library index: {len(self.library_index.books)} books, {rescanned_folders} folders rescanned in {time.monotonic() - scan_start:.2f}s")
+
+        except Exception as e:
+            self.general_logger.error(f"Error Scanning Library: {str(e)}")
+
+    def library_index_rescanner(self):
+        while True:
+            time.sleep(self.library_index_rescan_minutes * 60)
+            self.refresh_library_index()
+
+    def seed_library_index_from_readarr(self, readarr_ids):
+        try:
+            endpoint = f"{self.readarr_address}/api/v1/bookfile"
+            headers = {"X-Api-Key": self.readarr_api_key}
+            readarr_ids = list(readarr_ids)
+            for i in range(0, len(readarr_ids), 100):
+                response = self.http_client.get(endpoint, params={"bookId": readarr_ids[i : i + 100]}, headers=headers)
+                if response.status_code != 200:
+                    self.general_logger.warning(f"Readarr Book File API Error Code: {response.status_code}")
+                    return
+                self.library_index.add_readarr_ids(book_file["bookId"] for book_file in response.json())
+
+        except Exception as e:
+            self.general_logger.error(f"Error Checking Readarr Book Files: {str(e)}")
+
+    def shared_queue_monitor(self):
+        while True:
+            time.sleep(min(5, self.worker_lease_seconds / 3))
+            try:
+                self.queue_store.renew_leases(self.worker_id, self.worker_lease_seconds)
+                finished_statuses = self.queue_store.finished_statuses()
+                for req_item in list(self.libgen_items):
+                    status = finished_statuses.get(req_item.get("id"))
+                    if status and req_item.get("status") != status:
+                        self.update_libgen_item(req_item, status=status)
+                with self.libgen_update_lock:
+                    self.refresh_percent_completion()
+                stop_generation = self.coordination.counter("stop_generation")
+                start_generation = self.coordination.counter("start_generation")
+                if start_generation != self.start_generation:
+                    self.start_generation = start_generation
+                    self.libgen_user_stopped = False
+                if stop_generation != self.stop_generation:
+                    self.stop_generation = stop_generation
+                    self.general_logger.warning("Download queue stopped by another worker")
+                    self.libgen_user_stopped = True
+                    self.libgen_stop_event.set()
+                    continue
+                if not self.work_queue.running and not self.libgen_user_stopped and self.queue_store.claimable_count():
+                    self.libgen_stop_event.clear()
+                    self.start_master_queue()
+
+            except Exception as e:
+                self.general_logger.error(f"Error in Shared Queue Monitor: {str(e)}")
+
+    def queue_server_monitor(self):
+        while True:
+            time.sleep(min(5, self.worker_lease_seconds / 3))
+            try:
+                # Status changes go to the queue server with the heartbeat, it shows them in its web UI.
+                with self.libgen_update_lock:
+                    changes = [{"id": item_id, **fields} for item_id, fields in self.libgen_pending_changes.items()]
+                    self.libgen_pending_changes = {}
+                try:
+                    stop_generation, start_generation = self.queue_server.heartbeat(self.worker_id, self.worker_lease_seconds, changes)
+                except requests.RequestException:
+                    # The changes go with the next heartbeat, under anything newer recorded since.
+                    with self.libgen_update_lock:
+                        for change in changes:
+                            item_id = change.pop("id")
+                            self.libgen_pending_changes[item_id] = {**change, **self.libgen_pending_changes.get(item_id, {})}
+                    continue
+                if self.start_generation is not None and start_generation != self.start_generation:
+                    self.libgen_user_stopped = False
+                self.start_generation = start_generation
+                if self.stop_generation is not None and stop_generation != self.stop_generation:
+                    self.stop_generation = stop_generation
+                    self.general_logger.warning("Download queue stopped by the queue server")
+                    self.libgen_user_stopped = True
+                    self.libgen_stop_event.set()
+                    continue
+                self.stop_generation = stop_generation
+                if not self.work_queue.running and not self.libgen_user_stopped and self.queue_server.claimable_count():
+                    self.libgen_stop_event.clear()
+                    self.start_master_queue()
+
+            except Exception as e:
+                self.general_logger.error(f"Error in Queue Server Monitor: {str(e)}")
+
+    def apply_worker_changes(self, changes):
+        # Rows this process queued keep their own copy of the item, it takes the remote worker's status too.
+        with self.libgen_update_lock:
+            local_items = {req_item["id"]: req_item for req_item in self.libgen_items}
+            for change in changes:
+                item_id = change.pop("id")
+                if item_id in local_items:
+                    local_items[item_id].update(change)
+                self.libgen_pending_changes.setdefault(item_id, {}).update(change)
+            self.refresh_percent_completion()
+
+    def worker_heartbeat(self, worker_id, lease_seconds, changes):
+        self.queue_store.renew_leases(worker_id, lease_seconds)
+        self.apply_worker_changes(changes)
+        return {"stop_generation": self.coordination.counter("stop_generation"), "start_generation": self.coordination.counter("start_generation"), "claimable": self.queue_store.claimable_count()}
+
+    def worker_finish(self, req_item, state):
+        self.record_finished(req_item, state)
+        self.apply_worker_changes([{"id": req_item["queue_id"], "status": req_item["status"]}])
+
+    def retry_scheduler(self):
+        while True:
+            time.sleep(self.retry_check_interval)
+            try:
+                if self.libgen_user_stopped:
+                    # Retries wait for the user to start downloads again.
+                    continue
+                if self.shared_queue and not self.coordination.acquire("retry_scheduler", self.worker_id, self.retry_check_interval * 3):
+                    continue
+                due_items = self.retry_store.claim_due(time.time())
+                if not due_items:
+                    continue
+                self.general_logger.warning(f"Retrying {len(due_items)} books that failed earlier")
+                self.start_new_session_if_finished()
+                for req_item in due_items:
+                    req_item.update({"checked": True, "status": ""})
+                    self.enqueue_item(req_item, self.retry_priority)
+                self.start_master_queue()
+                self.flush_libgen_updates()
+
+            except Exception as e:
+                self.general_logger.error(f"Error in Retry Scheduler: {str(e)}")
+
+    def retry_policy(self, reason):
+        return self.retry_policies.get(reason) or self.retry_policies.get("default", [60, 5])
+
+    def retry_base_delay(self, reason):
+        return self.retry_policy(reason)[0] * 60
+
+    def schedule_retry(self, book_id, status):
+        reason = status.split(" : ")[0]
+        base_minutes, max_attempts = self.retry_policy(reason)
+        attempts = self.retry_store.attempts(book_id) + 1
+        next_eligible = None
+        if attempts < max_attempts:
+            delay = min(base_minutes * 60 * 2 ** (attempts - 1), self.retry_max_delay_hours * 3600)
+            next_eligible = time.time() + delay * random.uniform(1 - self.retry_jitter, 1 + self.retry_jitter)
+        else:
+            self.general_logger.info(f"Giving up on book {book_id} after {attempts} attempts: {reason}")
+        self.retry_store.record_failure(book_id, reason, attempts, next_eligible)
+
     def schedule_checker(self):
         try:
             while True:
                 current_hour = time.localtime().tm_hour
                 within_time_window = any(t == current_hour for t in self.sync_schedule)
+                if within_time_window and self.shared_queue and not self.coordination.acquire("sync_schedule", self.worker_id, 3000):
+                    # Another worker holds the scheduler lease and runs this sync.
+                    within_time_window = False
+
+                if within_time_window and self.libgen_user_stopped:
+                    self.general_logger.warning("Skipping scheduled sync, downloads were stopped from the web UI")
+                    within_time_window = False
 
                 if within_time_window:
                     self.general_logger.warning(f"Time to Start - as in a time window: {self.sync_schedule}")
                     self.get_wanted_list_from_readarr()
-                    if self.readarr_items:
-                        x = list(range(len(self.readarr_items)))
-                        self.add_items_to_download(x)
+                    x = [item["readarr_id"] for item in self.readarr_items if item["readarr_id"] in self.readarr_changed_ids]
+                    if x:
+                        self.add_items_to_download(x, priority=self.scheduled_priority)
+                    elif self.readarr_items:
+                        self.general_logger.warning("No New or Changed Missing Items")
                     else:
                         self.general_logger.warning("No Missing Items")
 
@@ -195,39 +2179,55 @@ class DataHandler:
             self.readarr_status = "busy"
             self.readarr_stop_event.clear()
             self.readarr_items = []
-            page = 1
-            while True:
-                if self.readarr_stop_event.is_set():
-                    return
-                endpoint = f"{self.readarr_address}/api/v1/wanted/missing"
-                params = {"apikey": self.readarr_api_key, "page": page}
-                response = requests.get(endpoint, params=params, timeout=self.request_timeout)
-                if response.status_code == 200:
-                    wanted_missing_items = response.json()
-                    if not wanted_missing_items["records"]:
+            self.readarr_changed_ids = set()
+            all_pages_fetched = True
+            first_page = self.fetch_readarr_wanted_page(1)
+            if first_page is None:
+                return
+
+            self.readarr_items.extend(self.parse_readarr_record(item) for item in first_page["records"])
+            self.emit_readarr_snapshot()
+            total_records = first_page.get("totalRecords", len(first_page["records"]))
+            total_pages = -(-total_records // self.readarr_page_size)
+            self.general_logger.warning(f"Readarr reports {total_records} wanted books across {total_pages} pages")
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.readarr_fetch_workers) as executor:
+                self.readarr_futures = []
+                future_pages = {}
+                for page in range(2, total_pages + 1):
+                    future = executor.submit(self.fetch_readarr_wanted_page, page)
+                    self.readarr_futures.append(future)
+                    future_pages[future] = page
+
+                fetched_pages = {}
+                next_page = 2
+                for future in concurrent.futures.as_completed(self.readarr_futures):
+                    if self.readarr_stop_event.is_set():
+                        for pending_future in self.readarr_futures:
+                            pending_future.cancel()
                         break
-                    for item in wanted_missing_items["records"]:
-                        if self.readarr_stop_event.is_set():
-                            break
-
-                        title = item["title"]
-                        author_and_title = item["authorTitle"]
-                        series = item["seriesTitle"]
-                        author_reversed = author_and_title.replace(title, "")
-                        author_with_sep = author_reversed.split(", ")
-                        author = "".join(reversed(author_with_sep)).title()
-                        year = item["releaseDate"][:4]
-
-                        new_item = {"author": author, "book_name": title, "series": series, "checked": True, "status": "", "year": year}
-                        self.readarr_items.append(new_item)
-                    page += 1
-                else:
-                    self.general_logger.error(f"Readarr Wanted API Error Code: {response.status_code}")
-                    self.general_logger.error(f"Readarr Wanted API Error Text: {response.text}")
-                    socketio.emit("new_toast_msg", {"title": f"Readarr API Error: {response.status_code}", "message": response.text})
-                    break
+                    fetched_pages[future_pages[future]] = future.result()
+                    pages_merged = False
+                    while next_page in fetched_pages:
+                        wanted_missing_items = fetched_pages.pop(next_page)
+                        if wanted_missing_items:
+                            self.readarr_items.extend(self.parse_readarr_record(item) for item in wanted_missing_items["records"])
+                        else:
+                            all_pages_fetched = False
+                        next_page += 1
+                        pages_merged = True
+                    if pages_merged:
+                        self.emit_readarr_snapshot()
 
             self.readarr_items.sort(key=lambda x: (x["author"], x["book_name"]))
+            if not self.readarr_stop_event.is_set():
+                added_ids, changed_ids, removed_ids = self.wanted_store.apply_sync(self.readarr_items, remove_missing=all_pages_fetched)
+                unsettled_ids = self.wanted_store.unsettled_ids()
+                if self.retry_enabled:
+                    # Failed books are left to their retry backoff rather than queued by every sync.
+                    unsettled_ids -= self.retry_store.scheduled_ids()
+                self.readarr_changed_ids = added_ids | changed_ids | unsettled_ids
+                self.general_logger.warning(f"Readarr Sync: {len(added_ids)} new, {len(changed_ids)} changed, {len(removed_ids)} no longer wanted")
             self.readarr_status = "stopped" if self.readarr_stop_event.is_set() else "complete"
 
         except Exception as e:
@@ -236,14 +2236,43 @@ class DataHandler:
             socketio.emit("new_toast_msg", {"title": "Error Getting Missing Books", "message": str(e)})
 
         finally:
-            socketio.emit("readarr_update", {"status": self.readarr_status, "data": self.readarr_items})
+            if self.readarr_status == "busy":
+                self.readarr_status = "stopped" if self.readarr_stop_event.is_set() else "error"
+            self.emit_readarr_snapshot()
+
+    def fetch_readarr_wanted_page(self, page):
+        if self.readarr_stop_event.is_set():
+            return None
+        endpoint = f"{self.readarr_address}/api/v1/wanted/missing"
+        params = {"apikey": self.readarr_api_key, "page": page, "pageSize": self.readarr_page_size}
+        fetch_start = time.monotonic()
+        response = self.http_client.get(endpoint, params=params, stop_event=self.readarr_stop_event)
+        metrics.observe("bookbounty_readarr_page_seconds", time.monotonic() - fetch_start)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            self.general_logger.error(f"Readarr Wanted API Error Code: {response.status_code}")
+            self.general_logger.error(f"Readarr Wanted API Error Text: {response.text}")
+            socketio.emit("new_toast_msg", {"title": f"Readarr API Error: {response.status_code}", "message": response.text})
+            return None
+
+    def parse_readarr_record(self, item):
+        title = item["title"]
+        author_and_title = item["authorTitle"]
+        series = item["seriesTitle"]
+        author_reversed = author_and_title.replace(title, "")
+        author_with_sep = author_reversed.split(", ")
+        author = "".join(reversed(author_with_sep)).title()
+        year = item["releaseDate"][:4]
+
+        return {"readarr_id": item["id"], "author": author, "book_name": title, "series": series, "checked": True, "status": "", "year": year}
 
     def trigger_readarr_scan(self):
         try:
             endpoint = "/api/v1/rootfolder"
             headers = {"X-Api-Key": self.readarr_api_key}
             root_folder_list = []
-            response = requests.get(f"{self.readarr_address}{endpoint}", headers=headers)
+            response = self.http_client.get(f"{self.readarr_address}{endpoint}", headers=headers)
             endpoint = "/api/v1/command"
             if response.status_code == 200:
                 root_folders = response.json()
@@ -255,7 +2284,7 @@ class DataHandler:
             if root_folder_list:
                 data = {"name": "RescanFolders", "folders": root_folder_list}
                 headers = {"X-Api-Key": self.readarr_api_key, "Content-Type": "application/json"}
-                response = requests.post(f"{self.readarr_address}{endpoint}", json=data, headers=headers)
+                response = self.http_client.post(f"{self.readarr_address}{endpoint}", json=data, headers=headers)
                 if response.status_code != 201:
                     self.general_logger.warning(f"Failed to start readarr library scan")
 
@@ -265,98 +2294,517 @@ class DataHandler:
         else:
             self.general_logger.warning(f"Readarr library scan started")
 
-    def add_items_to_download(self, data):
+    def add_items_to_download(self, readarr_ids, priority=None, sid=None):
+        queued_count = 0
         try:
+            if priority is None:
+                priority = self.manual_priority
             self.libgen_stop_event.clear()
-            if self.libgen_status == "complete" or self.libgen_status == "stopped":
-                self.libgen_items = []
-                self.percent_completion = 0
-            for i in range(len(self.readarr_items)):
-                if i in data:
-                    self.readarr_items[i]["status"] = "Queued"
-                    self.readarr_items[i]["checked"] = True
-                    self.libgen_items.append(self.readarr_items[i])
-                else:
-                    self.readarr_items[i]["checked"] = False
-
-            if self.libgen_in_progress_flag == False:
-                self.index = 0
-                self.libgen_in_progress_flag = True
-                thread = threading.Thread(target=self.master_queue, name="Queue_Thread")
-                thread.daemon = True
-                thread.start()
+            self.start_new_session_if_finished()
+            selected = set(readarr_ids)
+            selected_items = {}
+            for item in self.readarr_items:
+                item["checked"] = item["readarr_id"] in selected
+                if item["checked"]:
+                    selected_items[item["readarr_id"]] = item
+            missing_ids = selected - selected_items.keys()
+            if missing_ids:
+                # The wanted list may have been fetched by another worker.
+                selected_items.update((item["readarr_id"], item) for item in self.wanted_store.items(missing_ids))
+            if self.library_index_enabled and self.library_index_readarr_seed:
+                self.seed_library_index_from_readarr(selected_items.keys())
+            for readarr_id in readarr_ids:
+                req_item = selected_items.get(readarr_id)
+                if req_item is not None:
+                    req_item["checked"] = True
+                    queued_count += self.enqueue_item(req_item, priority)
+
+            self.start_master_queue()
 
         except Exception as e:
             self.general_logger.error(f"Error Adding Items to Download: {str(e)}")
-            socketio.emit("new_toast_msg", {"title": "Error adding new items", "message": str(e)})
+            socketio.emit("new_toast_msg", {"title": "Error adding new items", "message": str(e)}, to=sid)
 
         finally:
-            socketio.emit("libgen_update", {"status": self.libgen_status, "data": self.libgen_items, "percent_completion": self.percent_completion})
-            socketio.emit("new_toast_msg", {"title": "Download Queue Updated", "message": "New Items added to Queue"})
+            self.emit_libgen_snapshot(to=sid)
+            if queued_count:
+                socketio.emit("new_toast_msg", {"title": "Download Queue Updated", "message": f"{queued_count} items added to Queue"}, to=sid)
+            else:
+                socketio.emit("new_toast_msg", {"title": "Download Queue Updated", "message": "No new items added to Queue"}, to=sid)
+
+    def start_new_session_if_finished(self):
+        if self.libgen_status == "complete" or self.libgen_status == "stopped":
+            self.clear_libgen_items()
+            self.queue_store.clear_finished()
+
+    def enqueue_item(self, req_item, priority):
+        queue_id, added = self.queue_store.add(req_item, priority)
+        if not added:
+            # The book is already waiting or being downloaded, by this worker or another one.
+            return False
+        req_item["id"] = queue_id
+        req_item["queue_id"] = queue_id
+        if not self.work_queue.put(req_item, priority):
+            return False
+        self.record_trace(req_item, "queued", time.time(), priority=priority)
+        self.update_libgen_item(req_item, status="Queued")
+        self.add_libgen_item(req_item)
+        return True
+
+    def start_master_queue(self):
+        if self.work_queue.claim_run():
+            thread = threading.Thread(target=self.master_queue, name="Queue_Thread")
+            thread.daemon = True
+            thread.start()
+
+    def resume_download_queue(self):
+        try:
+            requeued_count = self.queue_store.requeue_in_flight()
+            pending_items = self.queue_store.pending_items()
+            self.retry_store.release_queued(req_item.get("readarr_id") for req_item in pending_items)
+            if pending_items:
+                self.general_logger.warning(f"Resuming download queue: {len(pending_items)} pending items ({requeued_count} were in flight)")
+                for req_item in pending_items:
+                    self.work_queue.put(req_item, req_item.pop("priority", self.resume_priority))
+                    self.record_trace(req_item, "queued", time.time(), resumed=True)
+                    self.add_libgen_item(req_item)
+                self.start_master_queue()
+
+        except Exception as e:
+            self.general_logger.error(f"Error Resuming Download Queue: {str(e)}")
 
     def master_queue(self):
         try:
-            while not self.libgen_stop_event.is_set() and self.index < len(self.libgen_items):
+            while True:
                 self.libgen_status = "running"
-                with concurrent.futures.ThreadPoolExecutor(max_workers=self.thread_limit) as executor:
-                    self.libgen_futures = []
-                    start_position = self.index
-                    for req_item in self.libgen_items[start_position:]:
-                        if self.libgen_stop_event.is_set():
-                            break
-                        self.libgen_futures.append(executor.submit(self.find_link_and_download, req_item))
-                    concurrent.futures.wait(self.libgen_futures)
+                if self.queue_engine == "pipeline":
+                    self.run_pipeline()
+                elif self.gevent_enabled():
+                    self.run_gevent_workers()
+                else:
+                    if self.queue_engine == "gevent":
+                        self.general_logger.warning("Gevent engine needs a gevent worker (monkey patched sockets), using threads instead")
+                    self.run_queue_workers()
 
-            if self.libgen_stop_event.is_set():
-                self.libgen_status = "stopped"
-                self.general_logger.warning("Downloading Stopped")
-                self.libgen_in_progress_flag = False
-            else:
-                self.libgen_status = "complete"
-                self.general_logger.warning("Downloading Finished")
-                self.libgen_in_progress_flag = False
-                if self.library_scan_on_completion:
-                    self.trigger_readarr_scan()
+                if self.libgen_stop_event.is_set():
+                    self.libgen_status = "stopped"
+                    self.general_logger.warning("Downloading Stopped")
+                else:
+                    self.libgen_status = "complete"
+                    self.general_logger.warning("Downloading Finished")
+                    if self.library_scan_on_completion and self.queue_server is None:
+                        self.trigger_readarr_scan()
+
+                if self.work_queue.finish_run():
+                    break
 
         except Exception as e:
             self.general_logger.error(f"Error in Master Queue: {str(e)}")
             self.libgen_status = "failed"
+            self.work_queue.finish_run()
             socketio.emit("new_toast_msg", {"title": "Error in Master Queue", "message": str(e)})
 
         finally:
-            socketio.emit("libgen_update", {"status": self.libgen_status, "data": self.libgen_items, "percent_completion": self.percent_completion})
+            self.flush_libgen_updates()
             socketio.emit("new_toast_msg", {"title": "End of Session", "message": f"Downloading {self.libgen_status.capitalize()}"})
 
-    def find_link_and_download(self, req_item):
+    def run_queue_workers(self):
+        worker_threads = []
+        for i in range(max(1, self.thread_limit)):
+            thread = threading.Thread(target=self.queue_worker, name=f"Queue_Worker_{i}")
+            thread.daemon = True
+            thread.start()
+            worker_threads.append(thread)
+        for thread in worker_threads:
+            thread.join()
+
+    def engine_concurrency(self):
+        if self.queue_engine == "gevent":
+            return self.gevent_concurrency
+        if self.queue_engine == "pipeline":
+            return max(self.search_workers or self.thread_limit, self.resolve_workers or self.thread_limit, self.download_workers or self.thread_limit)
+        return self.thread_limit
+
+    def queue_worker(self):
+        while True:
+            req_item = self.work_queue.get(self.libgen_stop_event)
+            if req_item is None:
+                break
+            self.run_profiled(self.find_link_and_download, req_item)
+
+    def gevent_enabled(self):
+        return self.queue_engine == "gevent" and monkey.is_module_patched("socket")
+
+    def run_blocking(self, func, *args):
+        # Parsing and hashing hold the hub for as long as they run, so greenlets hand them to gevent's threadpool.
+        if self.gevent_enabled():
+            return gevent.get_hub().threadpool.apply(func, args)
+        return func(*args)
+
+    def run_gevent_workers(self):
+        pool = gevent.pool.Pool(max(1, self.gevent_concurrency))
+        while True:
+            req_item = self.work_queue.get(self.libgen_stop_event)
+            if req_item is None:
+                break
+            pool.spawn(self.run_gevent_profiled, self.find_link_and_download, req_item)
+        pool.join()
+
+    def run_pipeline(self):
+        search_workers = self.search_workers or self.thread_limit
+        resolve_workers = self.resolve_workers or self.thread_limit
+        download_workers = self.download_workers or self.thread_limit
+        resolve_queue = queue.Queue(maxsize=max(1, self.pipeline_run_ahead))
+        download_queue = queue.Queue(maxsize=max(1, self.pipeline_run_ahead))
+
+        self.pipeline_stages = [
+            PipelineStage("search", search_workers, self.search_stage, self.work_queue, resolve_queue, self),
+            PipelineStage("resolve", resolve_workers, self.resolve_stage, resolve_queue, download_queue, self),
+            PipelineStage("download", download_workers, self.download_stage, download_queue, None, self),
+        ]
+        for stage in self.pipeline_stages:
+            stage.start()
+        stage_threads = [thread for stage in self.pipeline_stages for thread in stage.threads]
+
+        while True:
+            alive_threads = [thread for thread in stage_threads if thread.is_alive()]
+            if not alive_threads:
+                break
+            alive_threads[0].join(timeout=self.pipeline_report_interval)
+            if alive_threads[0].is_alive():
+                self.general_logger.warning("Pipeline: " + ", ".join(f"{stats['stage']} queue {stats['queue_depth']} done {stats['processed']} ({stats['per_minute']:.1f}/min)" for stats in self.pipeline_stats()))
+
+    def pipeline_stats(self):
+        return [stage.stats() for stage in self.pipeline_stages]
+
+    def record_trace(self, req_item, name, start, end=None, **details):
+        # Traces are kept apart from the queue items so they are not sent to the web UI.
+        trace_id = req_item.get("id")
+        if trace_id is None:
+            return
+        span = {"name": name, "start": start}
+        if end is not None:
+            span["end"] = end
+            span["duration"] = end - start
+        span.update(details)
+        with self.item_traces_lock:
+            spans = self.item_traces.get(trace_id)
+            if spans is None:
+                spans = self.item_traces[trace_id] = []
+                if len(self.item_traces) > self.item_trace_limit:
+                    self.item_traces.popitem(last=False)
+            spans.append(span)
+
+    @contextlib.contextmanager
+    def trace_span(self, req_item, name, **details):
+        start = time.time()
         try:
-            req_item["status"] = "Searching..."
-            socketio.emit("libgen_update", {"status": self.libgen_status, "data": self.libgen_items, "percent_completion": self.percent_completion})
-            search_results = self._link_finder(req_item)
-            if self.libgen_stop_event.is_set():
-                return
+            yield details
+        finally:
+            self.record_trace(req_item, name, start, time.time(), **details)
+
+    def item_trace(self, item_id):
+        with self.item_traces_lock:
+            spans = list(self.item_traces.get(item_id, []))
+        if not spans:
+            return None
+        req_item = next((item for item in self.libgen_items if item.get("id") == item_id), {})
+        return {"id": item_id, "author": req_item.get("author"), "book_name": req_item.get("book_name"), "status": req_item.get("status"), "spans": spans}
+
+    def trace_summary(self):
+        session_ids = {req_item.get("id") for req_item in self.libgen_items}
+        with self.item_traces_lock:
+            traces = [(item_id, list(spans)) for item_id, spans in self.item_traces.items() if item_id in session_ids]
+
+        durations = {}
+        item_totals = []
+        for item_id, spans in traces:
+            for span in spans:
+                if "duration" in span:
+                    durations.setdefault(span["name"], []).append(span["duration"])
+            item_totals.append((max(span.get("end", span["start"]) for span in spans) - min(span["start"] for span in spans), item_id))
+
+        span_stats = {}
+        for name, values in durations.items():
+            values.sort()
+            span_stats[name] = {
+                "count": len(values),
+                "total": sum(values),
+                "mean": sum(values) / len(values),
+                "p50": values[len(values) // 2],
+                "p90": values[min(len(values) - 1, int(len(values) * 0.9))],
+                "max": values[-1],
+            }
+        slowest_items = [{"id": item_id, "seconds": seconds} for seconds, item_id in sorted(item_totals, reverse=True)[:10]]
+        return {"items": len(traces), "spans": span_stats, "slowest_items": slowest_items}
+
+    def start_profiling(self, seconds):
+        with self.profile_lock:
+            if self.profile_until > time.monotonic():
+                return None
+            profile_folder = os.path.join(self.config_folder, "profiles")
+            os.makedirs(profile_folder, exist_ok=True)
+            self.profile_file = os.path.join(profile_folder, time.strftime("workers-%Y%m%d-%H%M%S.prof"))
+            self.profile_until = time.monotonic() + seconds
+            self.profilers = []
+        timer = threading.Timer(seconds, self.save_profile)
+        timer.daemon = True
+        timer.start()
+        self.general_logger.warning(f"Profiling queue workers for {seconds} seconds")
+        return self.profile_file
+
+    def run_profiled(self, func, *args):
+        if self.profile_until < time.monotonic():
+            return func(*args)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return func(*args)
+        try:
+            return func(*args)
+        finally:
+            profiler.disable()
+            with self.profile_lock:
+                self.profilers.append(profiler)
+
+    def run_gevent_profiled(self, func, *args):
+        # Greenlets share one OS thread and so one profiler, it stays enabled while any profiled item is still running.
+        if self.profile_until < time.monotonic():
+            return func(*args)
+        with self.profile_lock:
+            if self.gevent_profiler is None:
+                profiler = cProfile.Profile()
+                try:
+                    profiler.enable()
+                    self.gevent_profiler = profiler
+                except ValueError:
+                    pass
+            if self.gevent_profiler is not None:
+                self.gevent_profiled_items += 1
+            profiler = self.gevent_profiler
+        if profiler is None:
+            return func(*args)
+        try:
+            return func(*args)
+        finally:
+            with self.profile_lock:
+                self.gevent_profiled_items -= 1
+                if self.gevent_profiled_items == 0:
+                    self.gevent_profiler.disable()
+                    self.profilers.append(self.gevent_profiler)
+                    self.gevent_profiler = None
+
+    def save_profile(self):
+        with self.profile_lock:
+            profilers, self.profilers = self.profilers, []
+            self.profile_until = 0
+            profile_file = self.profile_file
+        if not profilers:
+            self.general_logger.warning("Profiling finished without any queue work to record")
+            return
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        stats.dump_stats(profile_file)
+        self.general_logger.warning(f"Saved profile of {len(profilers)} work items to: {profile_file}")
 
+    def find_link_and_download(self, req_item):
+        try:
+            search_results = self.search_stage(req_item, None)
             if search_results:
-                req_item["status"] = "Link Found"
-                socketio.emit("libgen_update", {"status": self.libgen_status, "data": self.libgen_items, "percent_completion": self.percent_completion})
-                for link in search_results:
-                    ret = self.download_from_libgen(req_item, link)
-                    if ret == "Success":
-                        req_item["status"] = "Download Complete"
-                        break
-                    elif ret == "Already Exists":
-                        req_item["status"] = "File Already Exists"
-                        break
-                else:
-                    req_item["status"] = ret
+                download_plan = self.resolve_stage(req_item, search_results)
+                self.download_stage(req_item, download_plan)
 
         except Exception as e:
             self.general_logger.error(f"Error Downloading: {str(e)}")
-            req_item["status"] = "Download Error"
+            self.update_libgen_item(req_item, status="Download Error")
 
         finally:
-            self.index += 1
-            self.percent_completion = 100 * (self.index / len(self.libgen_items)) if self.libgen_items else 0
-            socketio.emit("libgen_update", {"status": self.libgen_status, "data": self.libgen_items, "percent_completion": self.percent_completion})
+            self.finish_item(req_item)
+
+    def search_stage(self, req_item, payload):
+        if self.library_index_enabled and self.library_index.contains(req_item["author"], req_item["book_name"], req_item.get("readarr_id")):
+            self.general_logger.info(f'Already in library, skipping search: {req_item["author"]} - {req_item["book_name"]}')
+            self.record_trace(req_item, "library_hit", time.time())
+            self.update_libgen_item(req_item, status="File Already Exists")
+            return None
+        if self.queue_server is None:
+            self.queue_store.set_state(req_item["queue_id"], "in_progress", "Searching...")
+        self.update_libgen_item(req_item, status="Searching...")
+        search_start = time.monotonic()
+        with self.trace_span(req_item, "search") as span:
+            search_results = self._link_finder(req_item)
+            span["links"] = len(search_results) if search_results else 0
+        metrics.observe("bookbounty_search_seconds", time.monotonic() - search_start, search_type=self.search_type.lower(), source=self.search_source)
+        if search_results:
+            metrics.inc("bookbounty_match_outcomes_total", outcome="matched")
+        else:
+            metrics.inc("bookbounty_match_outcomes_total", outcome="no_match" if req_item.get("status") == "No Link Found" else "error")
+        if self.libgen_stop_event.is_set():
+            return None
+        return search_results
+
+    def resolve_stage(self, req_item, search_results):
+        self.update_libgen_item(req_item, status="Link Found")
+        download_plan = {"resolved": None, "remaining_links": [], "ret": "Dead Link"}
+        duplicate_ret = self.link_duplicate(req_item, search_results)
+        if duplicate_ret:
+            download_plan["ret"] = duplicate_ret
+            return download_plan
+        search_results = self.mirror_health.order_links(search_results, self.mirror_health_ordering)
+        if not search_results:
+            download_plan["ret"] = "Mirrors Unavailable"
+            return download_plan
+        if self.mirror_racing and len(search_results) > 1:
+            with self.trace_span(req_item, "race", links=len(search_results)):
+                winner, failures = self.race_mirrors(req_item, search_results)
+            if winner:
+                download_plan["resolved"] = winner
+                download_plan["remaining_links"] = [link for link in search_results if link != winner[3]]
+            elif failures:
+                # Every link has been tried by a probe, so report the last failure as the sequential loop would.
+                download_plan["ret"] = failures[-1]
+            return download_plan
+
+        for position, link in enumerate(search_results):
+            if self.libgen_stop_event.is_set():
+                break
+            if not self.mirror_available(link):
+                download_plan["ret"] = "Mirrors Unavailable"
+                continue
+            with self.trace_span(req_item, "resolve", link=link) as span:
+                resolved_link = self.resolve_download_link(req_item, link)
+                span["result"] = resolved_link if isinstance(resolved_link, str) else "Resolved"
+            if isinstance(resolved_link, str):
+                download_plan["ret"] = resolved_link
+                continue
+            link_url, file_type = resolved_link
+            download_plan["resolved"] = (link_url, file_type, None, link)
+            download_plan["remaining_links"] = search_results[position + 1 :]
+            break
+
+        return download_plan
+
+    def link_duplicate(self, req_item, search_results):
+        if self.duplicate_handling not in ("hardlink", "skip"):
+            return None
+        self.reserve_md5s(req_item, search_results)
+        for link in search_results:
+            md5 = self.expected_md5(req_item, link)
+            existing_path = self.content_hashes.get(md5) if md5 else None
+            if existing_path and os.path.exists(existing_path):
+                break
+            if existing_path:
+                self.content_hashes.remove(md5)
+        else:
+            return None
+
+        file_path = self.book_path_stem(req_item) + os.path.splitext(existing_path)[1]
+        if os.path.exists(file_path):
+            return "Already Exists"
+        if self.duplicate_handling == "skip":
+            self.general_logger.warning(f"Skipping download, same file already downloaded: {existing_path}")
+            return "Already Exists"
+
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            os.link(existing_path, file_path)
+
+        except OSError as e:
+            self.general_logger.error(f"Could not link duplicate {existing_path}, downloading instead: {str(e)}")
+            return None
+
+        self.library_index.add(file_path)
+        self.general_logger.warning(f"Linked duplicate download: {existing_path} to {file_path}")
+        return "Success"
+
+    def download_stage(self, req_item, download_plan):
+        ret = download_plan["ret"]
+        links_to_try = download_plan["remaining_links"]
+        if download_plan["resolved"]:
+            link_url, file_type, download_response, link = download_plan["resolved"]
+            attempt_start = time.time()
+            if download_response is None:
+                try:
+                    with self.trace_span(req_item, "connect", url=link_url):
+                        download_response = self.http_client.get(link_url, stream=True, stop_event=self.libgen_stop_event)
+
+                except Exception as e:
+                    self.update_libgen_item(req_item, status="Link Failed")
+                    self.general_logger.error(f"Exception {str(e)} thrown by: {link_url}")
+                    self.record_mirror_failure(link, str(e))
+                    download_response = None
+                    ret = "Link Failed"
+
+            if download_response is not None:
+                if self.libgen_stop_event.is_set():
+                    download_response.close()
+                    return None
+                ret = self.download_from_response(req_item, link, link_url, file_type, download_response)
+            self.record_trace(req_item, "link_attempt", attempt_start, time.time(), link=link, result=ret)
+
+        if ret not in ("Success", "Already Exists"):
+            for link in links_to_try:
+                with self.trace_span(req_item, "link_attempt", link=link) as span:
+                    ret = self.download_from_libgen(req_item, link)
+                    span["result"] = ret
+                if ret in ("Success", "Already Exists"):
+                    break
+
+        if ret == "Success":
+            self.update_libgen_item(req_item, status="Download Complete")
+        elif ret == "Already Exists":
+            self.update_libgen_item(req_item, status="File Already Exists")
+        else:
+            self.update_libgen_item(req_item, status=ret)
+        return None
+
+    def finish_item(self, req_item):
+        finished_outcomes = {"Download Complete": "downloaded", "File Already Exists": "exists", "No Link Found": "not_found"}
+        if self.libgen_stop_event.is_set():
+            metrics.inc("bookbounty_items_finished_total", outcome="stopped")
+            self.update_libgen_item(req_item, status="Download Stopped")
+            state = "stopped"
+        else:
+            metrics.inc("bookbounty_items_finished_total", outcome=finished_outcomes.get(req_item["status"], "failed"))
+            state = "done"
+        try:
+            if self.queue_server:
+                self.queue_server.finish(req_item, state)
+            else:
+                self.record_finished(req_item, state)
+
+        except Exception as e:
+            # The lease runs out and the queue server hands the item out again.
+            self.general_logger.error(f"Error Reporting Finished Item to Queue Server: {str(e)}")
+        with self.item_link_md5s_lock:
+            self.item_link_md5s.pop(req_item["id"], None)
+        self.release_md5s(req_item)
+        with self.libgen_update_lock:
+            self.libgen_completed_ids.add(req_item["id"])
+            self.refresh_percent_completion()
+        self.work_queue.task_done(req_item)
+        if self.sleep_interval:
+            self.libgen_stop_event.wait(self.sleep_interval)
+
+    def record_finished(self, req_item, state):
+        self.queue_store.set_state(req_item["queue_id"], state, req_item["status"])
+        if state == "done" and req_item.get("readarr_id") is not None:
+            self.wanted_store.update_status(req_item["readarr_id"], req_item["status"])
+            if req_item["status"] in ("Download Complete", "File Already Exists"):
+                self.retry_store.clear(req_item["readarr_id"])
+            elif self.retry_enabled:
+                self.schedule_retry(req_item["readarr_id"], req_item["status"])
+
+    def refresh_percent_completion(self):
+        if self.shared_queue:
+            # Other workers finish items too, so progress comes from the shared queue.
+            queue_counts = self.queue_store.summary()
+            finished_count = queue_counts.get("done", 0) + queue_counts.get("stopped", 0)
+            self.percent_completion = 100 * (finished_count / sum(queue_counts.values())) if queue_counts else 0
+        else:
+            self.percent_completion = 100 * (len(self.libgen_completed_ids) / len(self.libgen_items)) if self.libgen_items else 0
 
     def _link_finder(self, req_item):
         try:
@@ -369,91 +2817,78 @@ class DataHandler:
             query_text = f"{author_search_text} - {book_search_text}"
 
             found_links = []
-
-            if self.search_type.lower() == "non-fiction":
-                try:
-                    with self.libgen_thread_lock:
-                        s = LibgenSearch()
+            self.set_link_md5s(req_item, {})
+            cache_key = self.search_cache_key(author_search_text, book_search_text)
+            cached_result = self.search_cache.get(cache_key) if self.search_source != "local" else None
+            if self.search_source != "local":
+                metrics.inc("bookbounty_search_cache_total", result="hit" if cached_result else "miss")
+            if cached_result:
+                self.general_logger.warning(f"Using cached search result for: {query_text}")
+                self.record_trace(req_item, "cache_hit", time.time())
+
+            if self.search_source == "local":
+                with self.trace_span(req_item, "local_search"):
+                    found_links = self.local_link_finder(req_item, author, author_search_text, book_search_text)
+                if not found_links:
+                    self.update_libgen_item(req_item, status="No Link Found")
+
+            elif self.search_type.lower() == "non-fiction":
+                links_resolved = False
+                if cached_result:
+                    results = cached_result["candidates"]
+                    resolved_links = cached_result["links"]
+                else:
+                    resolved_links = {}
+                    try:
                         title_filters = {"Language": self.selected_language}
-                        results = s.search_title_filtered(book_search_text, title_filters, exact_match=False)
+                        with self.trace_span(req_item, "search_request"):
+                            results = self.non_fiction_search.search_title_filtered(book_search_text, title_filters)
                         self.general_logger.warning(f"Found {len(results)} potential matches")
 
-                except Exception as e:
-                    self.general_logger.error(f"Error with libgen_api search library: {str(e)}")
-                    results = None
-
-                for item in results:
-                    author_name_match_ratio = self.compare_author_names(item["Author"], author)
-                    book_name_match_ratio = fuzz.ratio(item["Title"], book_name)
-                    average_match_ratio = (author_name_match_ratio + book_name_match_ratio) / 2
-                    if average_match_ratio > self.minimum_match_ratio:
-                        download_links = s.resolve_download_links(item)
-                        found_links = [value for value in download_links.values()]
-                        break
+                    except Exception as e:
+                        self.general_logger.error(f"Error with non-fiction search: {str(e)}")
+                        results = None
+
+                with self.trace_span(req_item, "match"):
+                    item = self.match_non_fiction_results(results, author, book_name)
+                if item:
+                    if item["Mirror_1"] not in resolved_links:
+                        with self.trace_span(req_item, "resolve", link=item["Mirror_1"]):
+                            resolved_links[item["Mirror_1"]] = self.non_fiction_search.resolve_download_links(item)
+                        links_resolved = True
+                    found_links = resolved_links[item["Mirror_1"]]
+                    self.set_link_md5s(req_item, self.link_md5s(found_links, item["Mirror_1"]))
                 else:
-                    req_item["status"] = "No Link Found"
+                    self.update_libgen_item(req_item, status="No Link Found")
+
+                if not cached_result or links_resolved:
+                    self.search_cache.put(cache_key, results, resolved_links, self.search_cache_ttl(found_links), self.search_cache_max_entries)
 
             else:
-                search_item = query_text.replace(" ", "+")
-                url = f"{self.libgen_address}/fiction/?q={search_item}"
-                response = requests.get(url, timeout=self.request_timeout)
-                if response.status_code == 200:
-                    soup = BeautifulSoup(response.text, "html.parser")
-                    table = soup.find("tbody")
-                    if table:
-                        rows = table.find_all("tr")
+                if cached_result:
+                    candidates = cached_result["candidates"]
+                else:
+                    search_item = query_text.replace(" ", "+")
+                    url = f"{self.libgen_address}/fiction/?q={search_item}"
+                    with self.trace_span(req_item, "search_request") as span:
+                        response = self.http_client.get(url, stop_event=self.libgen_stop_event)
+                        span["status_code"] = response.status_code
+                    if response.status_code == 200:
+                        with self.trace_span(req_item, "parse"):
+                            candidates = self.run_blocking(self.parse_fiction_results, response.text)
                     else:
-                        rows = []
-
-                    for row in rows:
-                        try:
-                            cells = row.find_all("td")
-                            try:
-                                author_string = cells[0].get_text().strip()
-                            except:
-                                author_string = ""
-                            try:
-                                raw_title = cells[2].get_text().strip()
-                                if "\nISBN" in raw_title:
-                                    title_string = raw_title.split("\nISBN")[0]
-                                elif "\nASIN" in raw_title:
-                                    title_string = raw_title.split("\nASIN")[0]
-                                else:
-                                    title_string = raw_title
-                            except:
-                                title_string = ""
-                            try:
-                                language = cells[3].get_text().strip()
-                            except:
-                                language = "english"
-                            try:
-                                file_type = cells[4].get_text().strip().lower()
-                            except:
-                                file_type = ".epub"
-                            file_type_check = any(ft.replace(".", "").lower() in file_type for ft in self.preferred_extensions_fiction)
-                            language_check = language.lower() == self.selected_language.lower() or self.selected_language.lower() == "all"
-
-                            if file_type_check and language_check:
-                                author_name_match_ratio = self.compare_author_names(author, author_string)
-                                book_name_match_ratio = fuzz.ratio(title_string, book_search_text)
-                                if author_name_match_ratio >= self.minimum_match_ratio and book_name_match_ratio >= self.minimum_match_ratio:
-                                    mirrors = row.find("ul", class_="record_mirrors_compact")
-                                    links = mirrors.find_all("a", href=True)
-                                    for link in links:
-                                        href = link["href"]
-                                        if href.startswith("http://") or href.startswith("https://"):
-                                            found_links.append(href)
-                        except:
-                            pass
-
+                        candidates = None
+                        self.general_logger.error("Libgen Connection Error: " + str(response.status_code) + " Data: " + response.text)
+                        self.update_libgen_item(req_item, status="Libgen Error")
+
+                if candidates is not None:
+                    with self.trace_span(req_item, "match", candidates=len(candidates)):
+                        found_links = self.match_fiction_candidates(candidates, author, book_search_text)
+                    self.set_link_md5s(req_item, self.link_md5s(found_links))
                     if not found_links:
-                        req_item["status"] = "No Link Found"
-                    socketio.emit("libgen_update", {"status": "Success", "data": self.libgen_items, "percent_completion": self.percent_completion})
-                else:
-                    socketio.emit("libgen_update", {"status": "Error", "data": self.libgen_items, "percent_completion": self.percent_completion})
-                    self.general_logger.error("Libgen Connection Error: " + str(response.status_code) + " Data: " + response.text)
-                    req_item["status"] = "Libgen Error"
-                    socketio.emit("libgen_update", {"status": self.libgen_status, "data": self.libgen_items, "percent_completion": self.percent_completion})
+                        self.update_libgen_item(req_item, status="No Link Found")
+                    if not cached_result:
+                        self.search_cache.put(cache_key, candidates, found_links, self.search_cache_ttl(found_links), self.search_cache_max_entries)
 
         except Exception as e:
             self.general_logger.error(f"Error Searching libgen: {str(e)}")
@@ -462,11 +2897,209 @@ class DataHandler:
         finally:
             return found_links
 
+    def local_link_finder(self, req_item, author, author_search_text, book_search_text):
+        if self.search_type.lower() == "non-fiction":
+            source, mirror_templates = "non-fiction", self.local_index_non_fiction_mirrors
+        else:
+            source, mirror_templates = "fiction", self.local_index_fiction_mirrors
+        language = None if self.selected_language.lower() == "all" else self.selected_language
+
+        rows = self.local_index.search(source, author_search_text, book_search_text, language)
+        self.general_logger.warning(f"Found {len(rows)} potential matches in local index")
+        candidates = [{"author": row["author"], "title": row["title"], "language": row["language"], "file_type": row["extension"], "mirrors": [template.strip().format(md5=row["md5"]) for template in mirror_templates]} for row in rows]
+        found_links = self.match_fiction_candidates(candidates, author, book_search_text)
+
+        if self.search_type.lower() == "non-fiction":
+            # Non-fiction downloads expect direct links, so resolve the first mirror page that has any.
+            for mirror_link in found_links:
+                download_links = self.non_fiction_search.resolve_download_links({"Mirror_1": mirror_link})
+                if download_links:
+                    self.set_link_md5s(req_item, self.link_md5s(download_links, mirror_link))
+                    return download_links
+            return []
+        self.set_link_md5s(req_item, self.link_md5s(found_links))
+        return found_links
+
+    def link_md5s(self, links, md5_source=None):
+        # Libgen mirror links carry the book's MD5, which is checked against the downloaded file.
+        md5s = {}
+        for link in links:
+            md5 = self.md5_pattern.search(md5_source or link)
+            if md5:
+                md5s[link] = md5.group(0).lower()
+        return md5s
+
+    def reserve_md5s(self, req_item, search_results):
+        # A file is only recorded once its download finishes, so an item whose links resolve to a file another item
+        # is still downloading waits for that item, then links or skips the file like any earlier download.
+        md5s = {md5 for md5 in (self.expected_md5(req_item, link) for link in search_results) if md5}
+        while md5s:
+            with self.md5_reservations_lock:
+                owners = {self.md5_reservations[md5] for md5 in md5s if self.md5_reservations.get(md5, req_item["id"]) != req_item["id"]}
+                if not owners:
+                    self.md5_reservation_events.setdefault(req_item["id"], threading.Event())
+                    self.md5_reservations.update((md5, req_item["id"]) for md5 in md5s)
+                    return
+                owner_event = self.md5_reservation_events[owners.pop()]
+            self.update_libgen_item(req_item, status="Waiting for Duplicate")
+            while not owner_event.wait(timeout=1):
+                if self.libgen_stop_event.is_set():
+                    return
+
+    def release_md5s(self, req_item):
+        with self.md5_reservations_lock:
+            owner_event = self.md5_reservation_events.pop(req_item["id"], None)
+            if owner_event is None:
+                return
+            self.md5_reservations = {md5: owner for md5, owner in self.md5_reservations.items() if owner != req_item["id"]}
+        owner_event.set()
+
+    def set_link_md5s(self, req_item, md5s):
+        # Like traces, the MD5s are kept apart from the queue items so they are not sent to the web UI.
+        with self.item_link_md5s_lock:
+            self.item_link_md5s[req_item["id"]] = md5s
+            self.item_link_md5s.move_to_end(req_item["id"])
+            if len(self.item_link_md5s) > self.item_trace_limit:
+                self.item_link_md5s.popitem(last=False)
+
+    def expected_md5(self, req_item, link):
+        with self.item_link_md5s_lock:
+            return self.item_link_md5s.get(req_item.get("id"), {}).get(link)
+
+    def search_cache_ttl(self, found_links):
+        ttl_hours = self.search_cache_hit_ttl_hours if found_links else self.search_cache_miss_ttl_hours
+        return ttl_hours * 3600
+
+    def search_cache_key(self, author_search_text, book_search_text):
+        extensions = self.preferred_extensions_non_fiction if self.search_type.lower() == "non-fiction" else self.preferred_extensions_fiction
+        key_parts = [
+            self.search_type.lower(),
+            self.preprocess(author_search_text),
+            book_search_text.strip().lower(),
+            self.selected_language.lower(),
+            sorted(ext.strip().lower() for ext in extensions),
+        ]
+        return json.dumps(key_parts)
+
+    def parse_fiction_results(self, html):
+        parse_start = time.perf_counter()
+        if self.html_parser_backend == "fast":
+            rows = FictionResultsParser().parse(html)
+        else:
+            rows = self.parse_fiction_rows_bs4(html)
+        candidates = [self.fiction_candidate(cell_texts, mirror_hrefs) for cell_texts, mirror_hrefs in rows]
+        metrics.observe("bookbounty_parse_seconds", time.perf_counter() - parse_start, page="fiction_results", backend=self.html_parser_backend)
+        return candidates
+
+    def parse_fiction_rows_bs4(self, html):
+        rows = []
+        soup = BeautifulSoup(html, "html.parser")
+        table = soup.find("tbody")
+        if table:
+            for row in table.find_all("tr"):
+                cell_texts = [cell.get_text() for cell in row.find_all("td")]
+                mirrors = row.find("ul", class_="record_mirrors_compact")
+                mirror_hrefs = [link["href"] for link in mirrors.find_all("a", href=True)] if mirrors else []
+                rows.append((cell_texts, mirror_hrefs))
+        return rows
+
+    def fiction_candidate(self, cell_texts, mirror_hrefs):
+        try:
+            author_string = cell_texts[0].strip()
+        except:
+            author_string = ""
+        try:
+            raw_title = cell_texts[2].strip()
+            if "\nISBN" in raw_title:
+                title_string = raw_title.split("\nISBN")[0]
+            elif "\nASIN" in raw_title:
+                title_string = raw_title.split("\nASIN")[0]
+            else:
+                title_string = raw_title
+        except:
+            title_string = ""
+        try:
+            language = cell_texts[3].strip()
+        except:
+            language = "english"
+        try:
+            file_type = cell_texts[4].strip().lower()
+        except:
+            file_type = ".epub"
+
+        mirror_links = [href for href in mirror_hrefs if href.startswith("http://") or href.startswith("https://")]
+        return {"author": author_string, "title": title_string, "language": language, "file_type": file_type, "mirrors": mirror_links}
+
+    def parse_mirror_page(self, html):
+        parse_start = time.perf_counter()
+        if self.html_parser_backend == "fast":
+            mirror_link = MirrorPageParser().parse(html)
+        else:
+            mirror_link = self.parse_mirror_page_bs4(html)
+        metrics.observe("bookbounty_parse_seconds", time.perf_counter() - parse_start, page="mirror", backend=self.html_parser_backend)
+        return mirror_link
+
+    def parse_mirror_page_bs4(self, html):
+        soup = BeautifulSoup(html, "html.parser")
+        download_div = soup.find("div", id="download")
+        if download_div:
+            download_link = download_div.find("a")
+            return ("link", download_link.get("href")) if download_link else ("dead", None)
+
+        table = soup.find("table")
+        if not table:
+            return ("none", None)
+        for row in table.find_all("tr"):
+            if "GET" in row.get_text():
+                download_link = row.find("a")
+                if download_link:
+                    return ("table_link", download_link.get("href"))
+        return ("dead", None)
+
+    def match_fiction_candidates(self, candidates, author, book_search_text):
+        eligible_candidates = []
+        for candidate in candidates:
+            try:
+                file_type_check = any(ft.replace(".", "").lower() in candidate["file_type"] for ft in self.valid_book_extensions())
+                language_check = candidate["language"].lower() == self.selected_language.lower() or self.selected_language.lower() == "all"
+                if file_type_check and language_check:
+                    eligible_candidates.append(candidate)
+            except:
+                pass
+
+        # Titles are only scored for rows whose author already passed the cut-off.
+        author_matches = self.batch_ratio(self.preprocess(author), [self.preprocess(candidate["author"] or "") for candidate in eligible_candidates], self.minimum_match_ratio)
+        author_matched_candidates = [eligible_candidates[index] for index in sorted(author_matches)]
+        title_matches = self.batch_ratio(book_search_text, [candidate["title"] or "" for candidate in author_matched_candidates], self.minimum_match_ratio)
+
+        found_links = []
+        for index in sorted(title_matches):
+            found_links.extend(author_matched_candidates[index]["mirrors"])
+        return found_links
+
+    def match_non_fiction_results(self, results, author, book_name):
+        # The average of both ratios can only exceed the threshold if each ratio exceeds 2 * threshold - 100.
+        minimum_ratio = max(0, 2 * self.minimum_match_ratio - 100)
+        author_matches = self.batch_ratio(self.preprocess(author), [self.preprocess(item["Author"] or "") for item in results], minimum_ratio)
+        author_matched_indexes = sorted(author_matches)
+        title_matches = self.batch_ratio(book_name, [results[index]["Title"] or "" for index in author_matched_indexes], minimum_ratio)
+
+        for position, index in enumerate(author_matched_indexes):
+            if position in title_matches and (author_matches[index] + title_matches[position]) / 2 > self.minimum_match_ratio:
+                return results[index]
+        return None
+
+    def batch_ratio(self, query, choices, minimum_ratio):
+        # Scores are rounded to whole numbers before comparing, so the cut-off sits one point lower to keep borderline rows.
+        matches = process.extract(query, choices, scorer=fuzz.ratio, processor=None, limit=None, score_cutoff=max(0, minimum_ratio - 1))
+        scores = {index: int(round(score)) for _, score, index in matches}
+        return {index: score for index, score in scores.items() if score >= minimum_ratio}
+
     def compare_author_names(self, author, author_string):
         try:
             processed_author = self.preprocess(author)
             processed_author_string = self.preprocess(author_string)
-            match_ratio = fuzz.ratio(processed_author, processed_author_string)
+            match_ratio = int(round(fuzz.ratio(processed_author, processed_author_string)))
 
         except Exception as e:
             self.general_logger.error(f"Error Comparing Names: {str(e)}")
@@ -476,57 +3109,92 @@ class DataHandler:
             return match_ratio
 
     def preprocess(self, name):
-        name_string = name.replace(".", " ").replace(":", " ").replace(",", " ")
-        new_string = "".join(e for e in name_string if e.isalnum() or e.isspace()).lower()
-        words = new_string.split()
-        words.sort()
-        return " ".join(words)
+        return normalize_name(name)
 
     def download_from_libgen(self, req_item, link):
+        if not self.mirror_available(link):
+            return "Mirrors Unavailable"
+        with self.trace_span(req_item, "resolve", link=link) as span:
+            resolved_link = self.resolve_download_link(req_item, link)
+            span["result"] = resolved_link if isinstance(resolved_link, str) else "Resolved"
+        if isinstance(resolved_link, str):
+            return resolved_link
+        link_url, file_type = resolved_link
+
+        try:
+            with self.trace_span(req_item, "connect", url=link_url):
+                download_response = self.http_client.get(link_url, stream=True, stop_event=self.libgen_stop_event)
+
+        except Exception as e:
+            self.update_libgen_item(req_item, status="Link Failed")
+            self.general_logger.error(f"Exception {str(e)} thrown by: {link_url}")
+            self.record_mirror_failure(link, str(e))
+            return "Link Failed"
+
+        return self.download_from_response(req_item, link, link_url, file_type, download_response)
+
+    def mirror_available(self, link):
+        return self.mirror_health.allow(urlparse(link).netloc, self.mirror_cooldown_minutes * 60)
+
+    def record_mirror_failure(self, link, reason):
+        if self.libgen_stop_event.is_set():
+            # Requests cut short by a stop say nothing about the mirror.
+            return
+        host = urlparse(link).netloc
+        if self.mirror_health.record_failure(host, self.mirror_failure_threshold, self.mirror_cooldown_minutes * 60):
+            self.general_logger.warning(f"Skipping mirror {host} for {self.mirror_cooldown_minutes} minutes after repeated failures, last: {reason}")
+
+    def is_mirror_fault(self, status_code):
+        return status_code == 429 or status_code >= 500
+
+    def valid_book_extensions(self):
+        if self.search_type.lower() == "non-fiction":
+            return self.preferred_extensions_non_fiction
+        else:
+            return self.preferred_extensions_fiction
+
+    def resolve_download_link(self, req_item, link):
         if self.search_type.lower() == "non-fiction":
-            valid_book_extensions = self.preferred_extensions_non_fiction
             link_url = link
             try:
                 file_type = os.path.splitext(link_url)[1]
             except:
                 file_type = None
         else:
-            valid_book_extensions = self.preferred_extensions_fiction
-            response = requests.get(link, timeout=self.request_timeout)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, "html.parser")
-                download_div = soup.find("div", id="download")
+            resolve_start = time.monotonic()
+            try:
+                response = self.http_client.get(link, stop_event=self.libgen_stop_event)
 
-                if download_div:
-                    download_link = download_div.find("a")
-                    if download_link:
-                        link_url = download_link.get("href")
-                    else:
-                        return "Dead Link"
+            except Exception as e:
+                self.general_logger.error(f"Exception {str(e)} thrown by: {link}")
+                self.record_mirror_failure(link, str(e))
+                return "Link Failed"
+
+            if response.status_code == 200:
+                link_kind, link_text = self.run_blocking(self.parse_mirror_page, response.text)
+                metrics.observe("bookbounty_mirror_resolve_seconds", time.monotonic() - resolve_start, host=urlparse(link).netloc)
+                if link_kind == "dead":
+                    self.record_mirror_failure(link, "Dead Link")
                 else:
-                    table = soup.find("table")
-                    if table:
-                        rows = table.find_all("tr")
-                        for row in rows:
-                            if "GET" in row.get_text():
-                                download_link = row.find("a")
-                                if download_link:
-                                    link_text = download_link.get("href")
-                                    if "http" not in link_text:
-                                        link_url = "https://libgen.li/" + link_text
-                                    else:
-                                        link_url = link_text
-                                    break
-                        else:
-                            return "Dead Link"
+                    self.mirror_health.record_success(urlparse(link).netloc, ttfb=response.elapsed.total_seconds())
+                if link_kind == "link":
+                    link_url = link_text
+                elif link_kind == "table_link":
+                    if "http" not in link_text:
+                        link_url = "https://libgen.li/" + link_text
                     else:
-                        return "No Link Available"
+                        link_url = link_text
+                elif link_kind == "dead":
+                    return "Dead Link"
+                else:
+                    return "No Link Available"
 
             else:
+                if self.is_mirror_fault(response.status_code):
+                    self.record_mirror_failure(link, f"HTTP {response.status_code}")
                 return str(response.status_code) + " : " + response.text
 
-            req_item["status"] = "Checking Link"
-            socketio.emit("libgen_update", {"status": self.libgen_status, "data": self.libgen_items, "percent_completion": self.percent_completion})
+            self.update_libgen_item(req_item, status="Checking Link")
 
             try:
                 file_type = os.path.splitext(link_url)[1]
@@ -535,19 +3203,14 @@ class DataHandler:
                 file_type = None
                 self.general_logger.info("File extension not in url or invalid, checking link content...")
 
-        try:
-            download_response = requests.get(link_url, stream=True)
-
-        except Exception as e:
-            req_item["status"] = "Link Failed"
-            socketio.emit("libgen_update", {"status": self.libgen_status, "data": self.libgen_items, "percent_completion": self.percent_completion})
-            self.general_logger.error(f"Exception {str(e)} thrown by: {link_url}")
-            return "Link Failed"
+        return link_url, file_type
 
+    def response_file_type(self, file_type, download_response):
+        valid_book_extensions = self.valid_book_extensions()
         if file_type == None or ".php" in file_type:
             link_file_name_text = download_response.headers.get("content-disposition")
             if not link_file_name_text:
-                return "Unknown File Type"
+                return None, "Unknown File Type"
 
             for ext in valid_book_extensions:
                 if ext in link_file_name_text.lower():
@@ -555,13 +3218,114 @@ class DataHandler:
                     break
 
         if not file_type or file_type not in valid_book_extensions:
-            return "Wrong File Type"
+            return None, "Wrong File Type"
+
+        return file_type, None
+
+    def race_mirrors(self, req_item, links):
+        self.update_libgen_item(req_item, status="Racing Mirrors")
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(len(links), self.mirror_racing_max_probes), thread_name_prefix="Mirror_Probe")
+        futures = {executor.submit(self.probe_mirror, link): link for link in links}
+        winner = None
+        failures = {}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result() if future.exception() is None else "Link Failed"
+                if not isinstance(result, str):
+                    winner = result
+                    break
+                failures[futures[future]] = result
+                if self.libgen_stop_event.is_set():
+                    break
+
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+        if winner:
+            self.general_logger.warning(f"Fastest mirror for {req_item['book_name']}: {winner[0]}")
+        return winner, [failures[link] for link in links if link in failures]
+
+    def probe_mirror(self, link):
+        # Only the first byte is asked for and every probe is closed, the winner is requested in full when its download starts.
+        resolved_link = self.resolve_download_link({}, link)
+        if isinstance(resolved_link, str):
+            return resolved_link
+        link_url, file_type = resolved_link
+
+        try:
+            probe_response = self.http_client.get(link_url, stream=True, headers={"Range": "bytes=0-0"}, stop_event=self.libgen_stop_event)
+
+        except Exception as e:
+            self.general_logger.error(f"Exception {str(e)} thrown by: {link_url}")
+            self.record_mirror_failure(link, str(e))
+            return "Link Failed"
+
+        try:
+            if probe_response.status_code not in (200, 206):
+                if self.is_mirror_fault(probe_response.status_code):
+                    self.record_mirror_failure(link, f"HTTP {probe_response.status_code}")
+                return f"{probe_response.status_code} : {probe_response.text}"
+
+            file_type, error = self.response_file_type(file_type, probe_response)
+            if error:
+                return error
 
+        finally:
+            probe_response.close()
+
+        return link_url, file_type, None, link
+
+    def download_from_response(self, req_item, link, link_url, file_type, download_response):
+        try:
+            file_type, error = self.response_file_type(file_type, download_response)
+            if error:
+                return error
+
+            file_path = self.book_path_stem(req_item) + file_type
+
+            if os.path.exists(file_path):
+                self.general_logger.info("File already exists: " + file_path)
+                self.update_libgen_item(req_item, status="File Already Exists")
+                return "Already Exists"
+            else:
+                if self.selected_path_type == "folder":
+                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+            if self.libgen_stop_event.is_set():
+                raise Exception("Cancelled")
+
+            if download_response.status_code == 200:
+                # Download file
+                self.update_libgen_item(req_item, status="Downloading")
+                download_result = self.download_to_partial(req_item, link, link_url, download_response, file_path)
+                if download_result == "MD5 Mismatch":
+                    return download_result
+
+                if os.path.exists(file_path):
+                    self.general_logger.info(f"Downloaded: {link_url} to {file_path}")
+                    return "Success"
+                else:
+                    self.general_logger.info("Downloaded file not found in Directory")
+                    return "Failed"
+            else:
+                self.update_libgen_item(req_item, status="Download Error")
+                if self.is_mirror_fault(download_response.status_code):
+                    self.record_mirror_failure(link, f"HTTP {download_response.status_code}")
+                error_string = f"{download_response.status_code} : {download_response.text}"
+                self.general_logger.error(f"Error downloading: {os.path.basename(file_path)} - {error_string}")
+                return error_string
+
+        finally:
+            download_response.close()
+
+    def book_path_stem(self, req_item):
         cleaned_author_name = re.sub(r"\s{2,}", " ", re.sub(r'[\\*?:"<>|]', " - ", req_item["author"].replace("/", "+")))
         cleaned_book_name = re.sub(r"\s{2,}", " ", re.sub(r'[\\*?:"<>|]', " - ", req_item["book_name"].replace("/", "+")))
 
         if self.selected_path_type == "file":
-            file_path = os.path.join(self.download_folder, f"{cleaned_author_name} - {cleaned_book_name} ({req_item['year']}){file_type}")
+            return os.path.join(self.download_folder, f"{cleaned_author_name} - {cleaned_book_name} ({req_item['year']})")
 
         elif self.selected_path_type == "folder":
             path_elements = [self.download_folder, req_item["author"]]
@@ -574,76 +3338,208 @@ class DataHandler:
                     cleaned_series_name = re.sub(r"\s{2,}", " ", re.sub(r'[\\/*?:"<>|]', " - ", series_name.replace("/", "+")))
                     path_elements.append(cleaned_series_name)
                     path_elements.append(f"{series_number} - {cleaned_book_name} ({req_item['year']})")
-                    path_elements.append(f"{series_number} - {cleaned_series_name} - {cleaned_author_name} - {cleaned_book_name} ({req_item['year']}){file_type}")
+                    path_elements.append(f"{series_number} - {cleaned_series_name} - {cleaned_author_name} - {cleaned_book_name} ({req_item['year']})")
 
                 else:
                     series_name = raw_series_string.replace("/", "+")
                     cleaned_series_name = re.sub(r"\s{2,}", " ", re.sub(r'[\\/*?:"<>|]', " - ", series_name))
                     path_elements.append(cleaned_series_name)
                     path_elements.append(f"{cleaned_book_name} ({req_item['year']})")
-                    path_elements.append(f"{series_name} - {cleaned_author_name} - {cleaned_book_name} ({req_item['year']}){file_type}")
+                    path_elements.append(f"{series_name} - {cleaned_author_name} - {cleaned_book_name} ({req_item['year']})")
 
             else:
                 path_elements.append(f"{cleaned_book_name} ({req_item['year']})")
-                path_elements.append(f"{cleaned_author_name} - {cleaned_book_name} ({req_item['year']}){file_type}")
+                path_elements.append(f"{cleaned_author_name} - {cleaned_book_name} ({req_item['year']})")
+
+            return os.path.join(*path_elements)
+
+    def download_to_partial(self, req_item, link, link_url, download_response, file_path):
+        partial_path = f"{file_path}.part"
+        first_byte_seconds = download_response.elapsed.total_seconds()
+        sidecar_path = f"{partial_path}.json"
+        partial_info = {
+            "url": link_url,
+            "etag": download_response.headers.get("etag"),
+            "last_modified": download_response.headers.get("last-modified"),
+            "total_size": int(download_response.headers.get("content-length", 0)),
+            "bytes_written": 0,
+        }
+        previous_info = self.load_partial_info(sidecar_path)
+        if previous_info and os.path.exists(partial_path) and self.partial_matches(previous_info, partial_info):
+            partial_info["bytes_written"] = min(previous_info["bytes_written"], os.path.getsize(partial_path))
+
+        total_size = partial_info["total_size"]
+        self.general_logger.info(f"Downloading: {os.path.basename(file_path)} - Size: {total_size/1048576:.2f} MB")
+
+        resume_attempts = 0
+        transferred_size = 0
+        hasher = None
+        hashed_size = 0
+        download_start = time.monotonic()
+        try:
+            while True:
+                downloaded_size = attempt_start_size = partial_info["bytes_written"]
+                try:
+                    if partial_info["bytes_written"] > 0:
+                        download_response.close()
+                        headers = {"Range": f"bytes={partial_info['bytes_written']}-"}
+                        validator = partial_info["etag"] or partial_info["last_modified"]
+                        if validator:
+                            headers["If-Range"] = validator
+                        with self.trace_span(req_item, "connect", url=link_url, resume_from=partial_info["bytes_written"]):
+                            download_response = self.http_client.get(link_url, stream=True, headers=headers, stop_event=self.libgen_stop_event)
+                        if download_response.status_code == 206:
+                            self.general_logger.info(f"Resuming: {os.path.basename(file_path)} from {partial_info['bytes_written']/1048576:.2f} MB")
+                        elif download_response.status_code == 200:
+                            self.general_logger.info(f"Mirror does not support resuming, restarting: {os.path.basename(file_path)}")
+                            partial_info["bytes_written"] = 0
+                        else:
+                            raise Exception(f"Resume request failed with status {download_response.status_code}")
+                    elif resume_attempts > 0:
+                        download_response.close()
+                        with self.trace_span(req_item, "connect", url=link_url):
+                            download_response = self.http_client.get(link_url, stream=True, stop_event=self.libgen_stop_event)
+                        if download_response.status_code != 200:
+                            raise Exception(f"Retry request failed with status {download_response.status_code}")
+
+                    downloaded_size = attempt_start_size = partial_info["bytes_written"]
+                    if hasher is None or hashed_size != downloaded_size:
+                        hasher = self.run_blocking(self.hash_partial, partial_path, downloaded_size)
+                        hashed_size = downloaded_size
+                    next_progress_log = downloaded_size + self.download_progress_log_bytes
+                    next_sidecar_save = downloaded_size + self.download_sidecar_save_bytes
+                    transfer_start = time.time()
+                    first_byte = True
+                    with open(partial_path, "r+b" if downloaded_size > 0 else "wb", buffering=self.download_buffer_size) as f:
+                        f.truncate(downloaded_size)
+                        if self.download_preallocate and total_size > downloaded_size:
+                            self.preallocate_file(f, total_size)
+                        f.seek(downloaded_size)
+                        for chunk in download_response.iter_content(chunk_size=self.download_chunk_size):
+                            if self.libgen_stop_event.is_set():
+                                raise Exception("Cancelled")
+                            if first_byte:
+                                first_byte = False
+                                self.record_trace(req_item, "first_byte", transfer_start, time.time())
+                            self.run_blocking(hasher.update, chunk)
+                            f.write(chunk)
+                            downloaded_size += len(chunk)
+                            hashed_size = downloaded_size
+                            if downloaded_size >= next_progress_log:
+                                next_progress_log = downloaded_size + self.download_progress_log_bytes
+                                percent_completion = (downloaded_size / total_size) * 100 if total_size > 0 else 0
+                                self.general_logger.info(f"Downloading: {os.path.basename(file_path)} - Progress: {percent_completion:.2f}%")
+                            if downloaded_size >= next_sidecar_save:
+                                next_sidecar_save = downloaded_size + self.download_sidecar_save_bytes
+                                f.flush()
+                                partial_info["bytes_written"] = downloaded_size
+                                self.save_partial_info(sidecar_path, partial_info)
+                        f.truncate(downloaded_size)
+
+                    transferred_size += downloaded_size - attempt_start_size
+                    self.record_trace(req_item, "transfer", transfer_start, time.time(), bytes=downloaded_size - attempt_start_size)
+                    attempt_start_size = downloaded_size
+                    if total_size and downloaded_size < total_size:
+                        raise Exception(f"Incomplete download: {downloaded_size} of {total_size} bytes")
+                    break
 
-            file_path = os.path.join(*path_elements)
+                except Exception as e:
+                    transferred_size += downloaded_size - attempt_start_size
+                    self.general_logger.error(f"Error downloading to partial file: {str(e)}")
+                    if os.path.exists(partial_path):
+                        partial_info["bytes_written"] = min(downloaded_size, os.path.getsize(partial_path))
+                    self.save_partial_info(sidecar_path, partial_info)
+                    if self.libgen_stop_event.is_set() or resume_attempts >= self.download_resume_attempts:
+                        self.general_logger.info(f"Kept partial file for a later attempt: {partial_path}")
+                        self.record_download_metrics(link_url, transferred_size, time.monotonic() - download_start)
+                        if not self.libgen_stop_event.is_set():
+                            self.record_mirror_failure(link, str(e))
+                        return "Failed"
+                    resume_attempts += 1
+        finally:
+            # Resumed attempts swap in new responses, whichever is current gives its host slot back here.
+            download_response.close()
+
+        download_seconds = time.monotonic() - download_start
+        self.record_download_metrics(link_url, transferred_size, download_seconds)
+        file_md5 = hasher.hexdigest()
+        expected_md5 = self.expected_md5(req_item, link)
+        if self.download_verify_md5 and expected_md5 and file_md5 != expected_md5:
+            self.general_logger.error(f"MD5 mismatch for {os.path.basename(file_path)}: expected {expected_md5}, got {file_md5}")
+            self.record_mirror_failure(link, "MD5 mismatch")
+            for path in (partial_path, sidecar_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return "MD5 Mismatch"
+        self.mirror_health.record_success(urlparse(link).netloc, ttfb=first_byte_seconds, throughput=transferred_size / download_seconds if download_seconds > 0 else None)
+
+        self.general_logger.info(f"Moving partial file: {partial_path} to final location: {file_path}")
+        with self.trace_span(req_item, "move"):
+            os.replace(partial_path, file_path)
+        self.library_index.add(file_path)
+        self.content_hashes.put(file_md5, file_path, hashed_size)
+        if os.path.exists(sidecar_path):
+            os.remove(sidecar_path)
+        return "Success"
+
+    def hash_partial(self, partial_path, size):
+        # Only needed when resuming: the bytes already on disk are hashed once before appending.
+        hasher = hashlib.md5()
+        if size > 0:
+            with open(partial_path, "rb") as f:
+                remaining = size
+                while remaining > 0:
+                    block = f.read(min(remaining, self.download_chunk_size))
+                    if not block:
+                        break
+                    hasher.update(block)
+                    remaining -= len(block)
+        return hasher
+
+    def record_download_metrics(self, link_url, transferred_size, elapsed):
+        host = urlparse(link_url).netloc
+        metrics.inc("bookbounty_download_bytes_total", transferred_size, host=host)
+        metrics.observe("bookbounty_download_seconds", elapsed, host=host)
+        if elapsed > 0 and transferred_size > 0:
+            metrics.observe("bookbounty_download_throughput_bytes_per_second", transferred_size / elapsed, host=host)
+
+    def preallocate_file(self, f, size):
+        try:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(f.fileno(), 0, size)
+            else:
+                f.truncate(size)
 
-        if os.path.exists(file_path):
-            self.general_logger.info("File already exists: " + file_path)
-            req_item["status"] = "File Already Exists"
-            return "Already Exists"
-        else:
-            if self.selected_path_type == "folder":
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        except Exception as e:
+            self.general_logger.info(f"Preallocation not supported: {str(e)}")
 
-        if self.libgen_stop_event.is_set():
-            raise Exception("Cancelled")
+    def load_partial_info(self, sidecar_path):
+        try:
+            if os.path.exists(sidecar_path):
+                with open(sidecar_path, "r") as json_file:
+                    return json.load(json_file)
 
-        if download_response.status_code == 200:
-            # Download file
-            req_item["status"] = "Downloading"
-            socketio.emit("libgen_update", {"status": self.libgen_status, "data": self.libgen_items, "percent_completion": self.percent_completion})
+        except Exception as e:
+            self.general_logger.error(f"Error Loading Partial Download Info: {str(e)}")
 
-            total_size = int(download_response.headers.get("content-length", 0))
-            downloaded_size = 0
-            chunk_counter = 0
+        return None
 
-            self.general_logger.info(f"Downloading: {os.path.basename(file_path)} - Size: {total_size/1048576:.2f} MB")
+    def save_partial_info(self, sidecar_path, partial_info):
+        try:
+            with open(sidecar_path, "w") as json_file:
+                json.dump(partial_info, json_file)
 
-            try:
-                with tempfile.NamedTemporaryFile(delete=False) as f:
-                    for chunk in download_response.iter_content(chunk_size=1024):
-                        if self.libgen_stop_event.is_set():
-                            raise Exception("Cancelled")
-                        f.write(chunk)
-                        downloaded_size += len(chunk)
-                        chunk_counter += 1
-                        if chunk_counter % 100 == 0:
-                            percent_completion = (downloaded_size / total_size) * 100 if total_size > 0 else 0
-                            self.general_logger.info(f"Downloading: {os.path.basename(file_path)} - Progress: {percent_completion:.2f}%")
-
-                self.general_logger.info(f"Moving temp file: {f.name} to final location: {file_path}")
-                shutil.move(f.name, file_path)
+        except Exception as e:
+            self.general_logger.error(f"Error Saving Partial Download Info: {str(e)}")
 
-            except Exception as e:
-                self.general_logger.error(f"Error downloading to temp file: {str(e)}")
-                if os.path.exists(f.name):
-                    os.remove(f.name)
-                    self.general_logger.info(f"Removed temp file: {f.name}")
-
-            if os.path.exists(file_path):
-                self.general_logger.info(f"Downloaded: {link_url} to {file_path}")
-                return "Success"
-            else:
-                self.general_logger.info("Downloaded file not found in Directory")
-                return "Failed"
-        else:
-            req_item["status"] = "Download Error"
-            socketio.emit("libgen_update", {"status": self.libgen_status, "data": self.libgen_items, "percent_completion": self.percent_completion})
-            error_string = f"{download_response.status_code} : {download_response.text}"
-            self.general_logger.error(f"Error downloading: {os.path.basename(file_path)} - {error_string}")
-            return error_string
+    def partial_matches(self, previous_info, current_info):
+        if previous_info.get("total_size") and current_info["total_size"] and previous_info["total_size"] != current_info["total_size"]:
+            return False
+        if previous_info.get("etag") and current_info["etag"]:
+            return previous_info["etag"] == current_info["etag"]
+        if previous_info.get("last_modified") and current_info["last_modified"]:
+            return previous_info["last_modified"] == current_info["last_modified"]
+        return previous_info.get("url") == current_info["url"]
 
     def reset_readarr(self):
         self.readarr_stop_event.set()
@@ -652,30 +3548,41 @@ class DataHandler:
                 future.cancel()
         self.readarr_items = []
 
+    def start_libgen(self, readarr_ids, sid):
+        # Only the user lifts a Stop they issued, scheduled syncs and retries wait for it.
+        self.libgen_user_stopped = False
+        if self.shared_queue:
+            self.start_generation = self.coordination.increment("start_generation")
+        self.add_items_to_download(readarr_ids, sid=sid)
+
     def stop_libgen(self):
         try:
+            self.libgen_user_stopped = True
             self.libgen_stop_event.set()
-            for future in self.libgen_futures:
-                if not future.done():
-                    future.cancel()
-            for x in self.libgen_items[self.index :]:
-                x["status"] = "Download Stopped"
+            for x in self.work_queue.clear():
+                self.update_libgen_item(x, status="Download Stopped")
+            self.queue_store.stop_active()
+            self.retry_store.release_queued(delay_for=self.retry_base_delay)
+            if self.shared_queue:
+                self.stop_generation = self.coordination.increment("stop_generation")
 
         except Exception as e:
             self.general_logger.error(f"Error Stopping libgen: {str(e)}")
 
         finally:
             self.libgen_status = "stopped"
-            socketio.emit("libgen_update", {"status": self.libgen_status, "data": self.libgen_items, "percent_completion": self.percent_completion})
+            self.flush_libgen_updates()
 
     def reset_libgen(self):
         try:
+            self.libgen_user_stopped = True
             self.libgen_stop_event.set()
-            for future in self.libgen_futures:
-                if not future.done():
-                    future.cancel()
-            self.libgen_items = []
-            self.percent_completion = 0
+            self.work_queue.clear()
+            self.clear_libgen_items()
+            self.queue_store.clear()
+            self.retry_store.release_queued(delay_for=self.retry_base_delay)
+            if self.shared_queue:
+                self.stop_generation = self.coordination.increment("stop_generation")
 
         except Exception as e:
             self.general_logger.error(f"Error Resetting libgen: {str(e)}")
@@ -684,7 +3591,7 @@ class DataHandler:
             self.general_logger.warning("Reset Complete")
 
         finally:
-            socketio.emit("libgen_update", {"status": self.libgen_status, "data": self.libgen_items, "percent_completion": self.percent_completion})
+            self.flush_libgen_updates()
 
     def update_settings(self, data):
         try:
@@ -728,15 +3635,108 @@ class DataHandler:
 
 app = Flask(__name__)
 app.secret_key = "secret_key"
-socketio = SocketIO(app)
-data_handler = DataHandler()
-
+metrics = Metrics()
+socketio = MeteredSocketIO(app, message_queue=os.environ.get("socketio_message_queue") or None)
 
 @app.route("/")
 def home():
     return render_template("base.html")
 
 
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/queue")
+def queue_summary():
+    return jsonify(data_handler.queue_store.summary())
+
+
+@app.route("/api/pipeline")
+def pipeline_stats():
+    return jsonify(data_handler.pipeline_stats())
+
+
+@app.route("/api/queue/items")
+def queue_items():
+    state = request.args.get("state", "")
+    offset = request.args.get("offset", 0, type=int)
+    limit = min(request.args.get("limit", 100, type=int), 1000)
+    return jsonify(data_handler.queue_store.page(state, offset, limit))
+
+
+@app.route("/api/retries")
+def retry_summary():
+    return jsonify(data_handler.retry_store.summary())
+
+
+def worker_api_error():
+    # Remote workers take leases and write results, so every call has to carry the shared queue_server_token.
+    if not data_handler.shared_queue:
+        return jsonify({"error": "shared_queue is not enabled"}), 409
+    if not data_handler.queue_server_token:
+        return jsonify({"error": "queue_server_token is not set"}), 403
+    if not hmac.compare_digest(request.headers.get("X-Api-Key", "").encode(), data_handler.queue_server_token.encode()):
+        return jsonify({"error": "Invalid API key"}), 401
+    return None
+
+
+@app.route("/api/workers/claim", methods=["POST"])
+def worker_claim():
+    error = worker_api_error()
+    if error:
+        return error
+    data = request.get_json()
+    return jsonify({"item": data_handler.queue_store.claim(data["worker_id"], data["lease_seconds"])})
+
+
+@app.route("/api/workers/heartbeat", methods=["POST"])
+def worker_heartbeat():
+    error = worker_api_error()
+    if error:
+        return error
+    data = request.get_json()
+    return jsonify(data_handler.worker_heartbeat(data["worker_id"], data["lease_seconds"], data["changes"]))
+
+
+@app.route("/api/workers/finish", methods=["POST"])
+def worker_finish():
+    error = worker_api_error()
+    if error:
+        return error
+    data = request.get_json()
+    data_handler.worker_finish({"queue_id": data["queue_id"], "readarr_id": data["readarr_id"], "status": data["status"]}, data["state"])
+    return jsonify({})
+
+
+@app.route("/api/mirrors")
+def mirror_health():
+    return jsonify(data_handler.mirror_health.summary())
+
+
+@app.route("/api/trace")
+def trace_summary():
+    return jsonify(data_handler.trace_summary())
+
+
+@app.route("/api/trace/<int:item_id>")
+def item_trace(item_id):
+    trace = data_handler.item_trace(item_id)
+    if trace is None:
+        return jsonify({"error": "No trace recorded for this item"}), 404
+    return jsonify(trace)
+
+
+@app.route("/api/profile", methods=["POST"])
+def start_profiling():
+    seconds = min(max(request.args.get("seconds", 60, type=int), 1), 3600)
+    profile_file = data_handler.start_profiling(seconds)
+    if profile_file is None:
+        return jsonify({"error": "Profiling is already running"}), 409
+    return jsonify({"seconds": seconds, "file": profile_file})
+
+
 @socketio.on("readarr_get_wanted")
 def readarr():
     thread = threading.Thread(target=data_handler.get_wanted_list_from_readarr, name="Readarr_Thread")
@@ -766,12 +3766,17 @@ def reset_libgen():
 
 @socketio.on("add_to_download_list")
 def add_to_download_list(data):
-    data_handler.add_items_to_download(data)
+    data_handler.start_libgen(data, request.sid)
+
+
+@socketio.on("libgen_resync")
+def libgen_resync():
+    data_handler.emit_libgen_snapshot(to=request.sid)
 
 
 @socketio.on("connect")
 def connection():
-    data_handler.connect()
+    data_handler.connect(request.sid)
 
 
 @socketio.on("disconnect")
@@ -790,5 +3795,22 @@ def update_settings(data):
     data_handler.save_config_to_file()
 
 
+def import_index(args):
+    # Importing a dump runs on its own, without starting the app or resuming the download queue.
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    os.makedirs("config", exist_ok=True)
+    local_index = LocalIndex(os.path.join("config", "libgen_index.db"))
+    for dump_path in [arg for arg in args if arg != "--full"]:
+        local_index.import_dump(dump_path, "--full" in args, logging.getLogger())
+    print(json.dumps(local_index.summary(), indent=4))
+
+
+if __name__ == "__main__" and sys.argv[1:2] == ["import-index"]:
+    import_index(sys.argv[2:])
+    sys.exit(0)
+
+# The routes above only look data_handler up when they are called.
+data_handler = DataHandler()
+
 if __name__ == "__main__":
     socketio.run(app, host="0.0.0.0", port=5000)
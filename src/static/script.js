@@ -11,6 +11,9 @@ var stop_libgen = document.getElementById('stop-libgen-btn');
 var reset_libgen = document.getElementById('reset-libgen-btn');
 var libgen_progress_bar = document.getElementById('libgen-progress-status-bar');
 var libgen_table = document.getElementById('libgen-table').getElementsByTagName('tbody')[0];
+var libgen_status_cells = {};
+var libgen_seq = null;
+var libgen_source = null;
 
 var config_modal = document.getElementById('config-modal');
 var save_message = document.getElementById("save-message");
@@ -126,15 +129,15 @@ save_changes_button.addEventListener("click", () => {
 
 start_libgen.addEventListener('click', function () {
     start_libgen.disabled = true;
-    var checked_indices = [];
+    var checked_ids = [];
     var checkboxes = document.getElementsByName("readarr_item");
 
-    checkboxes.forEach(function (checkbox, index) {
+    checkboxes.forEach(function (checkbox) {
         if (checkbox.checked) {
-            checked_indices.push(index);
+            checked_ids.push(Number(checkbox.value));
         }
     });
-    socket.emit("add_to_download_list", checked_indices);
+    socket.emit("add_to_download_list", checked_ids);
     start_libgen.disabled = false;
 });
 
@@ -176,6 +179,7 @@ socket.on("readarr_update", (response) => {
         checkbox.className = "form-check-input";
         checkbox.id = "readarr_" + i;
         checkbox.name = "readarr_item";
+        checkbox.value = item.readarr_id;
         checkbox.checked = item.checked;
         checkbox.addEventListener("change", function () {
             check_if_all_true();
@@ -192,22 +196,71 @@ socket.on("readarr_update", (response) => {
     select_all_checkbox.checked = all_checked;
 });
 
+function add_libgen_row(entry) {
+    var row = libgen_table.insertRow();
+    var cell_item = row.insertCell(0);
+    var cell_item_status = row.insertCell(1);
+
+    cell_item.innerHTML = `${entry.author} - ${entry.book_name}`;
+    cell_item_status.innerHTML = entry.status;
+    cell_item_status.classList.add("text-center");
+    (libgen_status_cells[entry.id] = libgen_status_cells[entry.id] || []).push(cell_item_status);
+}
+
 socket.on("libgen_update", (response) => {
     libgen_table.innerHTML = '';
-    response.data.forEach(function (entry) {
-        var row = libgen_table.insertRow();
-        var cell_item = row.insertCell(0);
-        var cell_item_status = row.insertCell(1);
-
-        cell_item.innerHTML = `${entry.author} - ${entry.book_name}`;
-        cell_item_status.innerHTML = entry.status;
-        cell_item_status.classList.add("text-center");
-    });
+    libgen_status_cells = {};
+    libgen_seq = response.seq;
+    libgen_source = response.source;
+    response.data.forEach(add_libgen_row);
     var percent_completion = response.percent_completion;
     var actual_status = response.status;
     update_progress_bar(percent_completion, actual_status);
 });
 
+socket.on("libgen_patch", (response) => {
+    if (libgen_seq === null) {
+        return;
+    }
+    if (response.source !== libgen_source) {
+        // Status changes from other workers sharing the queue; their sequence numbers are their own.
+        apply_libgen_changes(response.changes);
+        return;
+    }
+    if (response.seq !== libgen_seq + 1) {
+        libgen_seq = null;
+        socket.emit("libgen_resync");
+        return;
+    }
+    libgen_seq = response.seq;
+    if (response.reset) {
+        libgen_table.innerHTML = '';
+        libgen_status_cells = {};
+    }
+    apply_libgen_changes(response.changes);
+    update_progress_bar(response.percent_completion, response.status);
+});
+
+function apply_libgen_changes(changes) {
+    changes.forEach(function (change) {
+        if ("previous_id" in change && change.previous_id in libgen_status_cells) {
+            // The book was queued again, its row now follows the new queue item.
+            libgen_status_cells[change.id] = libgen_status_cells[change.previous_id];
+            delete libgen_status_cells[change.previous_id];
+        }
+        if (!(change.id in libgen_status_cells) && "book_name" in change) {
+            add_libgen_row(change);
+            return;
+        }
+        var cells = libgen_status_cells[change.id] || [];
+        cells.forEach(function (cell) {
+            if ("status" in change) {
+                cell.innerHTML = change.status;
+            }
+        });
+    });
+}
+
 socket.on("new_toast_msg", function (data) {
     show_toast(data.title, data.message);
 });
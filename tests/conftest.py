@@ -0,0 +1,26 @@
+import os
+import sys
+import importlib.util
+import pytest
+
+source_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "BookBounty.py")
+
+
+@pytest.fixture(scope="session")
+def bookbounty(tmp_path_factory):
+    # BookBounty creates its config and download folders in the working directory on import.
+    original_folder = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("bookbounty"))
+    try:
+        spec = importlib.util.spec_from_file_location("BookBounty", source_file)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["BookBounty"] = module
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(original_folder)
+    return module
+
+
+@pytest.fixture
+def database_file(tmp_path):
+    return str(tmp_path / "bookbounty.db")
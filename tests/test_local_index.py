@@ -0,0 +1,79 @@
+import logging
+
+fiction_dump = """CREATE TABLE `fiction` (
+  `ID` int(10) unsigned NOT NULL AUTO_INCREMENT,
+  `MD5` char(32) DEFAULT NULL,
+  `Title` varchar(2000) DEFAULT '',
+  `Author` varchar(300) DEFAULT '',
+  `Language` varchar(45) DEFAULT '',
+  `Extension` varchar(10) DEFAULT '',
+  `Filesize` bigint(20) unsigned DEFAULT NULL,
+  `TimeLastModified` timestamp NOT NULL,
+  `Visible` char(3) DEFAULT '',
+  PRIMARY KEY (`ID`)
+) ENGINE=MyISAM;
+INSERT INTO `fiction` VALUES (1,'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA','A Wizard of Earthsea','Le Guin, Ursula K.','English','EPUB',4200000,'2020-01-01 00:00:00',''),(2,'BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB','The Tombs of Atuan','Le Guin, Ursula K.','English','MOBI',3100000,'2020-01-02 00:00:00','');
+INSERT INTO `fiction` VALUES (3,'CCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCC','Assassin\\'s Apprentice','Hobb, Robin','Spanish','azw3',NULL,'2020-01-03 00:00:00',''),(4,'DDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDD','Removed Book','Hobb, Robin','English','epub',100,'2020-01-04 00:00:00','del');
+"""
+
+update_dump = """INSERT INTO `fiction` (`MD5`, `Title`, `Author`, `Language`, `Extension`, `Filesize`, `TimeLastModified`, `Visible`) VALUES ('AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA','A Wizard of Earthsea','Le Guin, Ursula K.','English','EPUB',4200000,'2020-01-01 00:00:00','del'),('BBBBBBBBBBBBBBBBBBBBBBBBBBBBBBBB','The Tombs of Atuan: Revised','Le Guin, Ursula K.','English','MOBI',3100000,'2021-06-01 00:00:00','');
+"""
+
+
+def write_dump(tmp_path, file_name, text):
+    dump_path = tmp_path / file_name
+    dump_path.write_text(text, encoding="utf-8")
+    return str(dump_path)
+
+
+def test_parse_values_handles_quotes_escapes_and_null(bookbounty, database_file):
+    local_index = bookbounty.LocalIndex(database_file)
+
+    rows = list(local_index.parse_values("(1,'It''s','a\\\\b\\nc',NULL),(2,'(x, y)','',3.5);"))
+
+    assert rows == [["1", "It's", "a\\b\nc", None], ["2", "(x, y)", "", "3.5"]]
+
+
+def test_import_dump_loads_visible_fiction_records(bookbounty, database_file, tmp_path):
+    local_index = bookbounty.LocalIndex(database_file)
+
+    counts = local_index.import_dump(write_dump(tmp_path, "fiction.sql", fiction_dump), False, logging.getLogger(__name__))
+
+    assert counts == {"fiction": (4, 0)}
+    summary = local_index.summary()
+    assert summary["fiction"]["books"] == 3
+    assert summary["fiction"]["last_modified"] == "2020-01-04 00:00:00"
+
+
+def test_search_matches_author_and_title_words(bookbounty, database_file, tmp_path):
+    local_index = bookbounty.LocalIndex(database_file)
+    local_index.import_dump(write_dump(tmp_path, "fiction.sql", fiction_dump), False, logging.getLogger(__name__))
+
+    results = local_index.search("fiction", "Ursula Le Guin", "Wizard Earthsea", "english")
+
+    assert [result["md5"] for result in results] == ["aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa"]
+    assert results[0]["extension"] == "epub"
+    assert results[0]["filesize"] == 4200000
+    assert local_index.search("fiction", "Robin Hobb", "Assassin's Apprentice", "")[0]["title"] == "Assassin's Apprentice"
+    assert local_index.search("fiction", "Robin Hobb", "Assassin's Apprentice", "english") == []
+    assert local_index.search("fiction", "Robin Hobb", "Removed Book", "") == []
+    assert local_index.search("non-fiction", "Ursula Le Guin", "Wizard Earthsea", "") == []
+
+
+def test_import_dump_applies_updates_after_the_watermark(bookbounty, database_file, tmp_path):
+    local_index = bookbounty.LocalIndex(database_file)
+    logger = logging.getLogger(__name__)
+    local_index.import_dump(write_dump(tmp_path, "fiction.sql", fiction_dump), False, logger)
+
+    counts = local_index.import_dump(write_dump(tmp_path, "update.sql", update_dump), False, logger)
+
+    # The first record is older than the last import, so its Visible flag is not applied.
+    assert counts == {"fiction": (1, 1)}
+    assert local_index.search("fiction", "Le Guin", "Wizard Earthsea", "")
+    assert local_index.search("fiction", "Le Guin", "Tombs Atuan", "")[0]["title"] == "The Tombs of Atuan: Revised"
+    assert local_index.summary()["fiction"]["last_modified"] == "2021-06-01 00:00:00"
+
+    counts = local_index.import_dump(write_dump(tmp_path, "update.sql", update_dump), True, logger)
+
+    assert counts == {"fiction": (2, 0)}
+    assert local_index.search("fiction", "Le Guin", "Wizard Earthsea", "") == []
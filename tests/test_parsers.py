@@ -0,0 +1,64 @@
+import os
+import pytest
+
+fixture_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "fixtures")
+
+
+def read_fixture(file_name):
+    with open(os.path.join(fixture_folder, file_name), encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("file_name", ["fiction_results.html", "fiction_results_edge_cases.html", "fiction_results_empty.html"])
+def test_fiction_results_parser_matches_bs4(bookbounty, file_name):
+    html = read_fixture(file_name)
+
+    assert bookbounty.FictionResultsParser().parse(html) == bookbounty.data_handler.parse_fiction_rows_bs4(html)
+
+
+@pytest.mark.parametrize("file_name", ["mirror_dead.html", "mirror_libgen_li.html", "mirror_library_lol.html", "mirror_no_link.html"])
+def test_mirror_page_parser_matches_bs4(bookbounty, file_name):
+    html = read_fixture(file_name)
+
+    assert bookbounty.MirrorPageParser().parse(html) == bookbounty.data_handler.parse_mirror_page_bs4(html)
+
+
+def test_fiction_results_parser_reads_cells_and_mirrors(bookbounty):
+    rows = bookbounty.FictionResultsParser().parse(read_fixture("fiction_results.html"))
+
+    cell_texts, mirror_hrefs = rows[0]
+    assert cell_texts[0] == "Le Guin, Ursula K."
+    assert cell_texts[2] == "A Wizard of Earthsea: A Novel\nISBN: 9780765326355"
+    assert cell_texts[4] == "FB2 / 4.2 Mb"
+    assert mirror_hrefs == [
+        "http://library.lol/fiction/1B8A457A939C2EAD60F0436B21D7FBF0",
+        "https://libgen.li/ads.php?md5=1B8A457A939C2EAD60F0436B21D7FBF0",
+        "/fiction/1B8A457A939C2EAD60F0436B21D7FBF0.torrent",
+    ]
+
+
+def test_fiction_results_parser_handles_empty_results(bookbounty):
+    assert bookbounty.FictionResultsParser().parse(read_fixture("fiction_results_empty.html")) == []
+
+
+@pytest.mark.parametrize(
+    "file_name, expected",
+    [
+        ("mirror_library_lol.html", ("link", "https://download.library.lol/fiction/1234000/fbe322a89bc0ba531c3f0050e3935f28.epub/Brandon%20Sanderson%20-%20The%20Way%20of%20Kings.epub")),
+        ("mirror_libgen_li.html", ("table_link", "get.php?md5=fbe322a89bc0ba531c3f0050e3935f28&key=EXAMPLEKEY0123")),
+        ("mirror_dead.html", ("dead", None)),
+        ("mirror_no_link.html", ("none", None)),
+    ],
+)
+def test_mirror_page_parser_finds_download_link(bookbounty, file_name, expected):
+    assert bookbounty.MirrorPageParser().parse(read_fixture(file_name)) == expected
+
+
+def test_fiction_candidate_drops_isbn_and_relative_mirrors(bookbounty):
+    rows = bookbounty.FictionResultsParser().parse(read_fixture("fiction_results.html"))
+
+    candidate = bookbounty.data_handler.fiction_candidate(*rows[0])
+
+    assert candidate["title"] == "A Wizard of Earthsea: A Novel"
+    assert candidate["file_type"] == "fb2 / 4.2 mb"
+    assert all(mirror.startswith(("http://", "https://")) for mirror in candidate["mirrors"])
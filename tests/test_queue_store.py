@@ -0,0 +1,79 @@
+def queue_item(book_id):
+    return {"readarr_id": book_id, "author": "Robin Hobb", "book_name": f"Book {book_id}"}
+
+
+def test_add_skips_books_already_queued(bookbounty, database_file):
+    queue_store = bookbounty.QueueStore(database_file)
+
+    queue_id, added = queue_store.add(queue_item(1), 0)
+
+    assert added
+    assert queue_store.add(queue_item(1), 0) == (queue_id, False)
+    queue_store.set_state(queue_id, "done", "Download Complete")
+    assert queue_store.add(queue_item(1), 0)[1]
+
+
+def test_claim_takes_lowest_priority_first_then_oldest(bookbounty, database_file):
+    queue_store = bookbounty.QueueStore(database_file)
+    queue_store.add(queue_item(1), 5)
+    queue_store.add(queue_item(2), 0)
+    queue_store.add(queue_item(3), 0)
+
+    claimed = [queue_store.claim("worker-a", 60)["readarr_id"] for _ in range(3)]
+
+    assert claimed == [2, 3, 1]
+    assert queue_store.claim("worker-a", 60) is None
+    assert queue_store.claimable_count() == 0
+
+
+def test_claim_returns_item_with_queue_fields(bookbounty, database_file):
+    queue_store = bookbounty.QueueStore(database_file)
+    queue_id, _ = queue_store.add(queue_item(1), 2)
+
+    item = queue_store.claim("worker-a", 60)
+
+    assert item == {**queue_item(1), "id": queue_id, "queue_id": queue_id, "status": "Queued", "priority": 2}
+    assert queue_store.summary() == {"in_progress": 1}
+
+
+def test_expired_lease_is_claimed_by_another_worker(bookbounty, database_file):
+    queue_store = bookbounty.QueueStore(database_file)
+    queue_store.add(queue_item(1), 0)
+    queue_store.claim("worker-a", -1)
+
+    assert queue_store.claimable_count() == 1
+    assert queue_store.claim("worker-b", 60)["readarr_id"] == 1
+    assert queue_store.claim("worker-a", 60) is None
+
+
+def test_renewed_lease_is_not_claimed(bookbounty, database_file):
+    queue_store = bookbounty.QueueStore(database_file)
+    queue_store.add(queue_item(1), 0)
+    queue_store.claim("worker-a", -1)
+
+    queue_store.renew_leases("worker-a", 60)
+
+    assert queue_store.claimable_count() == 0
+    assert queue_store.claim("worker-b", 60) is None
+
+
+def test_requeue_in_flight_leaves_live_leases_alone(bookbounty, database_file):
+    queue_store = bookbounty.QueueStore(database_file)
+    queue_store.add(queue_item(1), 0)
+    queue_store.add(queue_item(2), 0)
+    queue_store.claim("worker-a", 60)
+    queue_store.claim("worker-b", -1)
+
+    assert queue_store.requeue_in_flight() == 1
+    assert [item["readarr_id"] for item in queue_store.pending_items()] == [2]
+
+
+def test_finished_items_are_not_claimed(bookbounty, database_file):
+    queue_store = bookbounty.QueueStore(database_file)
+    queue_id, _ = queue_store.add(queue_item(1), 0)
+    queue_store.claim("worker-a", -1)
+
+    queue_store.set_state(queue_id, "done", "Download Complete")
+
+    assert queue_store.claim("worker-b", 60) is None
+    assert queue_store.finished_statuses() == {queue_id: "Download Complete"}
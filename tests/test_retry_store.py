@@ -0,0 +1,82 @@
+import time
+import pytest
+
+
+@pytest.fixture
+def stores(bookbounty, database_file):
+    wanted_store = bookbounty.WantedStore(database_file)
+    wanted_store.apply_sync([{"readarr_id": book_id, "author": "Robin Hobb", "book_name": f"Book {book_id}", "series": "", "year": "1995"} for book_id in (1, 2, 3)], remove_missing=True)
+    return wanted_store, bookbounty.RetryStore(database_file)
+
+
+def test_claim_due_returns_only_due_waiting_books(stores):
+    _, retry_store = stores
+    retry_store.record_failure(1, "Not Found", 1, 100)
+    retry_store.record_failure(2, "Not Found", 1, 300)
+    retry_store.record_failure(3, "Not Found", 5, None)
+
+    assert [item["readarr_id"] for item in retry_store.claim_due(200)] == [1]
+    assert retry_store.claim_due(200) == []
+    assert [item["readarr_id"] for item in retry_store.claim_due(400)] == [2]
+    assert retry_store.summary()["Not Found"] == {"queued": {"count": 2, "next_eligible": 100}, "given_up": {"count": 1, "next_eligible": None}}
+
+
+def test_claim_due_drops_books_no_longer_wanted(stores):
+    wanted_store, retry_store = stores
+    retry_store.record_failure(1, "Not Found", 1, 100)
+    retry_store.record_failure(2, "Not Found", 1, 100)
+    wanted_store.apply_sync([wanted_store.items([1])[0]], remove_missing=True)
+
+    assert [item["readarr_id"] for item in retry_store.claim_due(200)] == [1]
+    assert retry_store.scheduled_ids() == {1}
+
+
+def test_release_queued_keeps_pending_books_and_delays_the_rest(stores):
+    _, retry_store = stores
+    retry_store.record_failure(1, "Not Found", 1, 100)
+    retry_store.record_failure(2, "Download Failed", 1, 100)
+    retry_store.claim_due(200)
+
+    retry_store.release_queued(keep_ids=[1], delay_for=lambda reason: 1e12)
+
+    summary = retry_store.summary()
+    assert summary["Not Found"] == {"queued": {"count": 1, "next_eligible": 100}}
+    assert summary["Download Failed"]["waiting"]["next_eligible"] > 1e12
+    assert retry_store.claim_due(200) == []
+
+
+def test_attempts_and_clear(stores):
+    _, retry_store = stores
+    assert retry_store.attempts(1) == 0
+
+    retry_store.record_failure(1, "Not Found", 3, 100)
+    assert retry_store.attempts(1) == 3
+
+    retry_store.clear(1)
+    assert retry_store.attempts(1) == 0
+    assert retry_store.scheduled_ids() == set()
+
+
+def test_schedule_retry_backs_off_exponentially_then_gives_up(bookbounty, stores, monkeypatch):
+    _, retry_store = stores
+    data_handler = bookbounty.data_handler
+    monkeypatch.setattr(data_handler, "retry_store", retry_store)
+    monkeypatch.setattr(data_handler, "retry_policies", {"Not Found": [10, 3]})
+    monkeypatch.setattr(data_handler, "retry_jitter", 0)
+    monkeypatch.setattr(data_handler, "retry_max_delay_hours", 1)
+
+    def scheduled_delay():
+        before = time.time()
+        data_handler.schedule_retry(1, "Not Found : no matching books")
+        next_eligible = retry_store.summary()["Not Found"]["waiting"]["next_eligible"]
+        return next_eligible - time.time(), next_eligible - before
+
+    low, high = scheduled_delay()
+    assert low <= 600 <= high
+
+    low, high = scheduled_delay()
+    assert low <= 1200 <= high
+    assert retry_store.attempts(1) == 2
+
+    data_handler.schedule_retry(1, "Not Found : no matching books")
+    assert retry_store.summary()["Not Found"] == {"given_up": {"count": 1, "next_eligible": None}}
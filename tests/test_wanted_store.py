@@ -0,0 +1,61 @@
+def wanted_item(book_id, **changes):
+    item = {"readarr_id": book_id, "author": "Ursula K. Le Guin", "book_name": f"Book {book_id}", "series": "", "year": "1968", "status": ""}
+    item.update(changes)
+    return item
+
+
+def test_apply_sync_adds_new_books(bookbounty, database_file):
+    store = bookbounty.WantedStore(database_file)
+
+    added, changed, removed = store.apply_sync([wanted_item(1), wanted_item(2)], remove_missing=True)
+
+    assert added == {1, 2}
+    assert changed == set()
+    assert removed == set()
+    assert sorted(item["book_name"] for item in store.items()) == ["Book 1", "Book 2"]
+
+
+def test_apply_sync_keeps_status_of_unchanged_books(bookbounty, database_file):
+    store = bookbounty.WantedStore(database_file)
+    store.apply_sync([wanted_item(1)], remove_missing=True)
+    store.update_status(1, "Download Complete")
+
+    items = [wanted_item(1)]
+    added, changed, removed = store.apply_sync(items, remove_missing=True)
+
+    assert (added, changed, removed) == (set(), set(), set())
+    assert items[0]["status"] == "Download Complete"
+    assert store.unsettled_ids() == set()
+
+
+def test_apply_sync_resets_status_of_changed_books(bookbounty, database_file):
+    store = bookbounty.WantedStore(database_file)
+    store.apply_sync([wanted_item(1)], remove_missing=True)
+    store.update_status(1, "Download Complete")
+
+    added, changed, removed = store.apply_sync([wanted_item(1, book_name="Book 1 Revised")], remove_missing=True)
+
+    assert changed == {1}
+    assert store.items([1])[0]["book_name"] == "Book 1 Revised"
+    assert store.items([1])[0]["status"] == ""
+    assert store.unsettled_ids() == {1}
+
+
+def test_apply_sync_removes_missing_books_only_when_asked(bookbounty, database_file):
+    store = bookbounty.WantedStore(database_file)
+    store.apply_sync([wanted_item(1), wanted_item(2)], remove_missing=True)
+
+    assert store.apply_sync([wanted_item(1)], remove_missing=False)[2] == set()
+    assert len(store.items()) == 2
+
+    assert store.apply_sync([wanted_item(1)], remove_missing=True)[2] == {2}
+    assert [item["readarr_id"] for item in store.items()] == [1]
+
+
+def test_unsettled_ids_include_failed_books(bookbounty, database_file):
+    store = bookbounty.WantedStore(database_file)
+    store.apply_sync([wanted_item(1), wanted_item(2), wanted_item(3)], remove_missing=True)
+    store.update_status(1, "File Already Exists")
+    store.update_status(2, "Not Found")
+
+    assert store.unsettled_ids() == {2, 3}